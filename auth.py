@@ -1,32 +1,120 @@
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-import os
+from uuid import UUID
+from concurrent.futures import ThreadPoolExecutor
+import os, asyncio
 
 from fastapi import Request, HTTPException, Depends
-from sqlalchemy.orm import Session
-from .database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import get_async_db
 from . import models
+from .utils.cache import TTLCache, RedisCache
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt work factor. Hashes made with a different one are upgraded on the next login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    # Any other factor counts as needing an update
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+# Hashing runs on its own threads (bcrypt releases the GIL), so login storms
+# neither block the event loop nor use up the shared threadpool. Beyond
+# PASSWORD_HASH_MAX_PENDING hashes in flight, requests get 429.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", PASSWORD_HASH_WORKERS * 4))
+hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hashes_pending = 0
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 
+# Authenticated users are cached briefly so most requests skip the users query
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL_SECONDS", 30))
+USER_CACHE_MAX_ITEMS = int(os.getenv("USER_CACHE_MAX_ITEMS", 10000))
+# Optional Redis URL so all instances share (and invalidate) one cache
+USER_CACHE_REDIS_URL = os.getenv("USER_CACHE_REDIS_URL")
+
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+async def run_hasher(fn, *args):
+    global _hashes_pending
+    if _hashes_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(status_code=429, detail="Too many login attempts in progress, try again shortly", headers={"Retry-After": "1"})
+    _hashes_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(hash_executor, fn, *args)
+    finally:
+        _hashes_pending -= 1
+
+async def hash_password(password: str) -> str:
+    return await run_hasher(get_password_hash, password)
+
+async def check_password(plain: str, hashed: str) -> tuple[bool, str | None]:
+    """
+    Verify a password in the hashing pool. Also returns a new hash when the
+    stored one was made with another work factor, for the caller to save.
+    """
+    return await run_hasher(pwd_context.verify_and_update, plain, hashed)
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
+class UserCache:
+    """
+    Cache of the user row behind a token, keyed by token subject ("id:<uuid>"
+    or "email:<address>"). A per-process TTL cache sits in front of the
+    optional shared one. Cached users are detached User objects holding only
+    the columns below.
+    """
+    FIELDS = ("id", "username", "email", "is_verified")
+
+    def __init__(self):
+        self.local = TTLCache(USER_CACHE_MAX_ITEMS, USER_CACHE_TTL)
+        self.shared = RedisCache(USER_CACHE_REDIS_URL, USER_CACHE_TTL, "user:") if USER_CACHE_REDIS_URL else None
+
+    async def get(self, key: str):
+        data = self.local.get(key)
+        if data is None and self.shared:
+            data = await self.shared.get(key)
+            if data is not None:
+                self.local.set(key, data)
+        if data is None:
+            return None
+        return models.User(**{**data, "id": UUID(data["id"])})
+
+    async def set(self, key: str, user: models.User):
+        data = {field: getattr(user, field) for field in self.FIELDS}
+        data["id"] = str(data["id"])
+        self.local.set(key, data)
+        if self.shared:
+            await self.shared.set(key, data)
+
+    async def invalidate(self, user: models.User):
+        """Call after changing a user row. Other processes' local copies expire within the TTL."""
+        keys = [f"id:{user.id}", f"email:{user.email}"]
+        for key in keys:
+            self.local.delete(key)
+        if self.shared:
+            await self.shared.delete(*keys)
+
+user_cache = UserCache()
+
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_async_db)):
     token = None
 
     # 1. Try to get token from cookies
@@ -48,12 +136,23 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email = payload.get("sub")
+        user_id = UUID(payload["uid"]) if payload.get("uid") else None
         if not email:
             raise HTTPException(status_code=401, detail="Invalid token")
-    except JWTError:
+    except (JWTError, ValueError):
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-    user = db.query(models.User).filter(models.User.email == email).first()
+    # Tokens issued before "uid" was added are looked up by email
+    cache_key = f"id:{user_id}" if user_id else f"email:{email}"
+    user = await user_cache.get(cache_key)
+    if user:
+        return user
+
+    if user_id:
+        user = await db.get(models.User, user_id)
+    else:
+        user = await db.scalar(select(models.User).where(models.User.email == email))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    await user_cache.set(cache_key, user)
     return user
\ No newline at end of file
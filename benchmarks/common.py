@@ -0,0 +1,15 @@
+"""Helpers shared by the benchmarks."""
+import asyncio, time
+
+TICK = 0.01
+
+
+async def ticker(lags: list, stop: asyncio.Event):
+    """Sleep TICK seconds until stop is set, recording how late each wake-up is (event-loop lag)."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+def p99(sorted_values: list) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * 0.99))]
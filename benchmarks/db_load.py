@@ -0,0 +1,87 @@
+"""
+Database access under concurrent load: sync session vs async session.
+
+Each simulated request does what an authenticated listing does: look the
+user up by email, then read one page of their files. Three modes are run:
+
+  sync-on-loop  sync Session inside an async handler (the old fileSave/signup)
+  sync-thread   sync Session in the threadpool (plain `def` routes)
+  async         AsyncSession on asyncpg (get_async_db)
+
+Needs DATABASE_URL (or the unix-socket settings) like the app. Run from the
+directory above the app package:
+
+    python -m app.benchmarks.db_load --requests 2000 --concurrency 100
+"""
+import argparse, asyncio, statistics, time
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from app import models
+from app.database import SessionLocal, AsyncSessionLocal, async_engine
+
+
+def sync_request(email: str):
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.email == email).first()
+        if user:
+            db.query(models.File.id, models.File.original_name).filter(
+                models.File.owner_id == user.id, models.File.deleted_at.is_(None)
+            ).limit(100).all()
+    finally:
+        db.close()
+
+async def async_request(email: str):
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(select(models.User).where(models.User.email == email))
+        if user:
+            (await db.execute(select(models.File.id, models.File.original_name).where(
+                models.File.owner_id == user.id, models.File.deleted_at.is_(None)
+            ).limit(100))).all()
+
+async def one(mode: str, email: str):
+    if mode == "sync-on-loop":
+        sync_request(email)
+    elif mode == "sync-thread":
+        await run_in_threadpool(sync_request, email)
+    else:
+        await async_request(email)
+
+async def run(mode: str, emails: list, requests: int, concurrency: int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await one(mode, emails[i % len(emails)])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = sorted(l * 1000 for l in latencies)
+    p99 = latencies_ms[min(len(latencies_ms) - 1, int(len(latencies_ms) * 0.99))]
+    print(
+        f"{mode:>12}: {requests / elapsed:8.1f} req/s, latency p50 {statistics.median(latencies_ms):7.1f} ms, "
+        f"p99 {p99:7.1f} ms"
+    )
+
+async def main_async(args):
+    async with AsyncSessionLocal() as db:
+        emails = (await db.execute(select(models.User.email).limit(100))).scalars().all() or ["nobody@example.com"]
+    for mode in ("sync-on-loop", "sync-thread", "async"):
+        await run(mode, emails, args.requests, args.concurrency)
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
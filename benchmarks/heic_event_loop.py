@@ -0,0 +1,79 @@
+"""
+Event-loop latency while HEIC uploads are being converted.
+
+A ticker sleeps TICK seconds in a loop and records how late it wakes up,
+which is how long any other request on the worker would have waited. The
+same batch of concurrent conversions is run inline (the old fileSave
+behaviour) and through the image process pool.
+
+Run from the directory above the app package:
+
+    python -m app.benchmarks.heic_event_loop --uploads 16 --size 3000
+"""
+import argparse, asyncio, io, statistics, time
+import pillow_heif
+from PIL import Image
+from app.utils.images import ImagePool, ImagePoolBusy, convert_heic, IMAGE_WORKERS
+from app.benchmarks.common import ticker, p99
+
+
+def make_heic(size: int) -> bytes:
+    # Noise compresses badly, so decoding does real work
+    image = Image.effect_noise((size, size), 64).convert("RGB")
+    buffer = io.BytesIO()
+    pillow_heif.from_pillow(image).save(buffer, format="HEIF", quality=90)
+    return buffer.getvalue()
+
+async def run(mode: str, data: bytes, uploads: int, pool: ImagePool, output_format: str):
+    lags, stop = [], asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+    rejected = 0
+
+    async def upload():
+        nonlocal rejected
+        if mode == "inline":
+            await asyncio.sleep(0)
+            convert_heic(data, output_format)
+            return
+        try:
+            await pool.submit(convert_heic, data, output_format)
+        except ImagePoolBusy:
+            rejected += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(upload() for _ in range(uploads)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick_task
+
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    print(
+        f"{mode:>6}: {elapsed:6.2f}s total, loop lag p50 {statistics.median(lags_ms):7.1f} ms, "
+        f"p99 {p99(lags_ms):7.1f} ms, max {lags_ms[-1]:7.1f} ms, rejected {rejected}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=16, help="concurrent HEIC uploads")
+    parser.add_argument("--size", type=int, default=3000, help="image edge in pixels")
+    parser.add_argument("--workers", type=int, default=IMAGE_WORKERS)
+    parser.add_argument("--max-pending", type=int, default=None, help="defaults to --uploads (no 429s)")
+    parser.add_argument("--format", default="JPEG", choices=["JPEG", "WEBP", "AVIF"])
+    args = parser.parse_args()
+
+    data = make_heic(args.size)
+    print(f"{args.uploads} uploads of a {args.size}x{args.size} HEIC ({len(data) / 1e6:.1f} MB) -> {args.format}")
+
+    pool = ImagePool(args.workers, args.max_pending or args.uploads)
+    try:
+        # Start the workers first so process spawn time isn't measured
+        asyncio.run(pool.submit(pow, 2, 2))
+        asyncio.run(run("inline", data, args.uploads, pool, args.format))
+        asyncio.run(run("pool", data, args.uploads, pool, args.format))
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Image-analysis throughput (captioning + OCR) on CPU, in images/sec.
+
+Two modes over the same images:
+
+  serial   the old preprocess behaviour: full-size images, one per
+           captioner call, OCR inline
+  batched  downsized images, PREPROCESS_CAPTION_BATCH_SIZE per captioner
+           call, OCR in PREPROCESS_OCR_WORKERS processes alongside
+
+Images come from --dir, or are generated (photo-sized, with some text to
+OCR). --full-size also skips downsizing in batched mode, to separate what
+batching and the process pool save from what downsizing saves.
+
+Run from the directory above the app package:
+
+    python -m app.benchmarks.image_analysis --images 32 --batch-size 8
+"""
+import argparse, io, os, random, time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw
+from app.utils import preprocess
+
+
+def synthetic_images(count: int, width: int, height: int) -> list:
+    images = []
+    for i in range(count):
+        image = Image.new("RGB", (width, height), tuple(random.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for line in range(10):
+            draw.text((width // 10, height // 12 * (line + 1)), f"Invoice {i}-{line} total {random.randrange(10 ** 6)}", fill=(0, 0, 0))
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+def directory_images(path: str, count: int) -> list:
+    names = sorted(name for name in os.listdir(path) if os.path.splitext(name)[1].lower() in preprocess.IMAGE_EXTENSIONS)
+    images = []
+    for name in names[:count]:
+        with open(os.path.join(path, name), "rb") as f:
+            images.append(f.read())
+    return images
+
+FULL_SIZE = 1 << 16
+
+@contextmanager
+def full_size():
+    """No downsizing before inference (OCR inline sees this; pool workers keep their own settings)."""
+    edges = preprocess.CAPTION_MAX_EDGE, preprocess.OCR_MAX_EDGE
+    preprocess.CAPTION_MAX_EDGE = preprocess.OCR_MAX_EDGE = FULL_SIZE
+    try:
+        yield
+    finally:
+        preprocess.CAPTION_MAX_EDGE, preprocess.OCR_MAX_EDGE = edges
+
+def run(mode: str, images: list, captioner, batch_size: int, ocr_pool):
+    start = time.perf_counter()
+    if mode == "serial":
+        preprocess.CAPTION_BATCH_SIZE = 1
+        with full_size():
+            for file_bytes in images:
+                preprocess.analyze_images([file_bytes], captioner)
+    else:
+        preprocess.CAPTION_BATCH_SIZE = batch_size
+        for offset in range(0, len(images), batch_size):
+            preprocess.analyze_images(images[offset:offset + batch_size], captioner, ocr_pool)
+    elapsed = time.perf_counter() - start
+    print(f"{mode:>8}: {len(images) / elapsed:6.2f} images/s ({elapsed:.1f}s for {len(images)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--dir", help="directory of .jpg/.png files to use instead of generated ones")
+    parser.add_argument("--size", default="4000x3000", help="generated image size, WIDTHxHEIGHT")
+    parser.add_argument("--batch-size", type=int, default=preprocess.CAPTION_BATCH_SIZE)
+    parser.add_argument("--ocr-workers", type=int, default=preprocess.OCR_WORKERS)
+    parser.add_argument("--full-size", action="store_true", help="do not downsize before inference")
+    args = parser.parse_args()
+
+    if args.dir:
+        images = directory_images(args.dir, args.images)
+    else:
+        width, height = (int(v) for v in args.size.split("x"))
+        images = synthetic_images(args.images, width, height)
+    if args.full_size:
+        preprocess.CAPTION_MAX_EDGE = preprocess.OCR_MAX_EDGE = FULL_SIZE
+
+    captioner = preprocess.load_captioner()
+    preprocess.analyze_images(images[:1], captioner)  # first call pays for lazy initialisation
+    print(
+        f"{len(images)} images, batch size {args.batch_size}, {args.ocr_workers} OCR workers, "
+        f"batched max edge caption {preprocess.CAPTION_MAX_EDGE} / OCR {preprocess.OCR_MAX_EDGE}"
+    )
+    with ProcessPoolExecutor(max_workers=args.ocr_workers) as ocr_pool:
+        run("serial", images, captioner, args.batch_size, ocr_pool)
+        run("batched", images, captioner, args.batch_size, ocr_pool)
+
+
+if __name__ == "__main__":
+    main()
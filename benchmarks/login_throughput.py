@@ -0,0 +1,63 @@
+"""
+Login throughput and event-loop latency while passwords are being checked.
+
+A burst of concurrent logins is verified either inline on the event loop
+(the old signup/login behaviour) or through auth's hashing pool, while a
+ticker measures how late the loop wakes up. Runs without a database; set
+BCRYPT_ROUNDS / PASSWORD_HASH_WORKERS to compare settings.
+
+Run from the directory above the app package:
+
+    python -m app.benchmarks.login_throughput --logins 64
+"""
+import argparse, asyncio, statistics, time
+from fastapi import HTTPException
+from app import auth
+from app.benchmarks.common import ticker, p99
+
+
+async def run(mode: str, hashed: str, logins: int):
+    lags, stop = [], asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+    rejected = 0
+
+    async def login():
+        nonlocal rejected
+        if mode == "inline":
+            await asyncio.sleep(0)
+            auth.pwd_context.verify_and_update("correct horse", hashed)
+            return
+        try:
+            await auth.check_password("correct horse", hashed)
+        except HTTPException:
+            rejected += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick_task
+
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    print(
+        f"{mode:>6}: {(logins - rejected) / elapsed:7.1f} logins/s, loop lag p50 {statistics.median(lags_ms):7.1f} ms, "
+        f"p99 {p99(lags_ms):7.1f} ms, max {lags_ms[-1]:7.1f} ms, rejected {rejected}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=64, help="concurrent logins")
+    args = parser.parse_args()
+
+    hashed = auth.get_password_hash("correct horse")
+    print(
+        f"{args.logins} logins, bcrypt rounds {auth.BCRYPT_ROUNDS}, {auth.PASSWORD_HASH_WORKERS} hash workers, "
+        f"max pending {auth.PASSWORD_HASH_MAX_PENDING}"
+    )
+    asyncio.run(run("inline", hashed, args.logins))
+    asyncio.run(run("pool", hashed, args.logins))
+
+
+if __name__ == "__main__":
+    main()
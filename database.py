@@ -1,7 +1,10 @@
-from sqlalchemy import create_engine, make_url
+from sqlalchemy import create_engine, make_url, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-import os
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, NullPool
+import os, time, threading, uuid
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,6 +13,125 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 
 from sqlalchemy.engine.url import URL
 
+# Connection pool settings, per process. The sync and async engines each keep
+# their own pool, so one process opens up to DB_POOL_SIZE + DB_MAX_OVERFLOW +
+# DB_ASYNC_POOL_SIZE + DB_ASYNC_MAX_OVERFLOW connections (20 by default).
+# Request handlers use the async engine; the sync one serves the remaining
+# sync routes, background jobs and the workers.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 2))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 3))
+DB_ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", 5))
+DB_ASYNC_MAX_OVERFLOW = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+# Recycle connections before Cloud SQL / load balancers drop idle ones
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Per-statement timeout in milliseconds, 0 = none
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+# Behind PgBouncer in transaction mode: no client-side pool, no prepared
+# statement cache, and settings applied per transaction
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+
+class PoolStats:
+    """Checkout wait times for one engine's pool."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited: float, timed_out: bool = False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def snapshot(self, pool) -> dict:
+        stats = {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(self.wait_total / max(self.checkouts + self.timeouts, 1) * 1000, 3),
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+        if isinstance(pool, QueuePool):
+            stats.update({
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow,
+            })
+        return stats
+
+class TimedPoolMixin:
+    """Records how long each checkout waited for a connection."""
+    stats: PoolStats
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return conn
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    stats = PoolStats()
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    stats = PoolStats()
+
+
+def engine_options(is_async: bool) -> dict:
+    """create_engine / create_async_engine keyword arguments from the DB_* settings."""
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    connect_args = {}
+
+    if DB_PGBOUNCER:
+        options["poolclass"] = NullPool
+        if is_async:
+            # asyncpg's prepared statements don't survive transaction pooling
+            connect_args["statement_cache_size"] = 0
+            connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid.uuid4()}__"
+    else:
+        options.update({
+            "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+            "pool_size": DB_ASYNC_POOL_SIZE if is_async else DB_POOL_SIZE,
+            "max_overflow": DB_ASYNC_MAX_OVERFLOW if is_async else DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+        })
+        if DB_STATEMENT_TIMEOUT_MS:
+            if is_async:
+                connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+            else:
+                connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+def configure_engine(engine):
+    """
+    PgBouncer doesn't forward startup options in transaction mode, so there
+    the statement timeout is set at the start of every transaction instead.
+    """
+    if DB_PGBOUNCER and DB_STATEMENT_TIMEOUT_MS:
+        sync_engine = getattr(engine, "sync_engine", engine)
+
+        @event.listens_for(sync_engine, "begin")
+        def set_statement_timeout(conn):
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+    return engine
+
 def get_engine():
     use_unix_socket = os.getenv("USE_UNIX_SOCKET", "false").lower() == "true"
 
@@ -20,26 +142,76 @@ def get_engine():
         db_name = os.environ["DB_NAME"]
         unix_socket_path = os.environ["INSTANCE_UNIX_SOCKET"]  # e.g. /cloudsql/...
 
-        return create_engine(
+        return configure_engine(create_engine(
             URL.create(
                 drivername="postgresql+psycopg2",  # or mysql+pymysql for MySQL
                 username=db_user,
                 password=db_pass,
                 database=db_name,
                 query={"host": unix_socket_path},
-            )
-        )
+            ),
+            **engine_options(is_async=False),
+        ))
     else:
         # Local dev over TCP
         db_url = os.getenv("DATABASE_URL")
         if not db_url:
             raise RuntimeError("DATABASE_URL not set for local dev")
-        return create_engine(db_url)
+        return configure_engine(create_engine(db_url, **engine_options(is_async=False)))
+
+# libpq (psycopg2) URL parameters asyncpg.connect doesn't take: renamed ones
+# are translated, the rest dropped
+ASYNCPG_RENAMED_PARAMS = {"sslmode": "ssl", "connect_timeout": "timeout"}
+ASYNCPG_DROPPED_PARAMS = {
+    "sslcert", "sslkey", "sslrootcert", "sslcrl", "sslpassword", "application_name", "options",
+    "target_session_attrs", "gssencmode", "keepalives", "keepalives_idle", "keepalives_interval",
+    "keepalives_count", "client_encoding",
+}
+
+def async_url(db_url: str) -> URL:
+    """DATABASE_URL as written for the sync engine, rewritten for asyncpg."""
+    url = make_url(db_url)
+    query = {}
+    for name, value in url.query.items():
+        if name in ASYNCPG_DROPPED_PARAMS:
+            continue
+        query[ASYNCPG_RENAMED_PARAMS.get(name, name)] = value
+    return url.set(drivername="postgresql+asyncpg", query=query)
+
+def get_async_engine():
+    """
+    Same database as get_engine, through asyncpg, for request handlers that
+    must not block the event loop. Scripts and background jobs keep using the
+    sync engine.
+    """
+    use_unix_socket = os.getenv("USE_UNIX_SOCKET", "false").lower() == "true"
 
-# Global engine
+    if use_unix_socket:
+        return configure_engine(create_async_engine(
+            URL.create(
+                drivername="postgresql+asyncpg",
+                username=os.environ["DB_USER"],
+                password=os.environ["DB_PASS"],
+                database=os.environ["DB_NAME"],
+                query={"host": os.environ["INSTANCE_UNIX_SOCKET"]},
+            ),
+            **engine_options(is_async=True),
+        ))
+    else:
+        db_url = os.getenv("DATABASE_URL")
+        if not db_url:
+            raise RuntimeError("DATABASE_URL not set for local dev")
+        return configure_engine(create_async_engine(
+            async_url(db_url), **engine_options(is_async=True)
+        ))
+
+# Global engines
 engine = get_engine()
+async_engine = get_async_engine()
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False)
+# Objects stay usable after commit; reloading them would need an await
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 def get_db():
@@ -47,4 +219,16 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def pool_metrics() -> dict:
+    """Occupancy and checkout wait times of both engines' pools."""
+    return {
+        "pgbouncer_mode": DB_PGBOUNCER,
+        "sync": TimedQueuePool.stats.snapshot(engine.pool),
+        "async": TimedAsyncQueuePool.stats.snapshot(async_engine.pool),
+    }
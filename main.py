@@ -1,13 +1,20 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import user, cdn
-from app.database import engine
+from app.routes import user, cdn, uploads, downloads
+from app.database import engine, pool_metrics
 from app.routes import ai  
 from app import models
+from app.migrations import run_migrations
+from app.utils.images import image_pool
+from app.utils import ai as ai_utils
+from app.utils import indexer
+from starlette.concurrency import run_in_threadpool
 import os
+import asyncio
 
 # Create DB tables
 models.Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 app = FastAPI()
 origins = ["*"]
@@ -20,7 +27,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def start_trash_collector():
+    app.state.trash_collector = asyncio.create_task(cdn.run_trash_collector())
+
+@app.on_event("startup")
+async def load_local_cache():
+    # Walks the whole store; in a thread so startup isn't held up
+    app.state.local_cache_load = asyncio.create_task(run_in_threadpool(cdn.local_cache.load))
+
+@app.on_event("startup")
+async def warm_up_ai():
+    # In the background, so the server takes file traffic while models load
+    app.state.ai_warmup = asyncio.create_task(ai_utils.warm_up_until_ready())
+
+@app.on_event("startup")
+async def start_indexer():
+    if indexer.INDEX_WORKER_IN_APP:
+        app.state.indexer = asyncio.create_task(indexer.run_indexer())
+
+@app.on_event("shutdown")
+def stop_image_pool():
+    image_pool.shutdown()
+
+@app.on_event("shutdown")
+def stop_indexer():
+    indexer.shutdown()
+
+@app.get("/metrics/db-pool", tags=["metrics"])
+def db_pool_metrics():
+    return pool_metrics()
+
+@app.get("/metrics/indexer", tags=["metrics"])
+async def indexer_metrics():
+    return await indexer.index_metrics()
+
 # Register all route modules
 app.include_router(user.router, tags=["Auth"])
 app.include_router(cdn.router, prefix="/files", tags=["files"])
+app.include_router(uploads.router, prefix="/files/uploads", tags=["files"])
+app.include_router(downloads.router, prefix="/files", tags=["files"])
 app.include_router(ai.router, prefix="/ai")
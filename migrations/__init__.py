@@ -0,0 +1,41 @@
+"""
+Schema migrations for changes that Base.metadata.create_all can't make on
+an existing database (new columns, indexes, data fixes).
+
+Each module in MIGRATIONS defines upgrade(conn). Applied ids are recorded in
+schema_migrations, so running this repeatedly is safe. It runs on startup
+from main.py and can be run by hand with `python -m app.migrations`.
+"""
+import importlib
+from sqlalchemy import text
+
+MIGRATIONS = [
+    "m0001_file_blobs",
+    "m0002_restore_renamed_s3_urls",
+    "m0003_folder_tree",
+    "m0004_user_drive_version",
+    "m0005_trash",
+    "m0006_direct_uploads",
+    "m0007_file_thumbnails",
+    "m0008_upload_session_activity",
+]
+
+# Arbitrary key so concurrently starting instances migrate one at a time
+MIGRATION_LOCK_ID = 720311
+
+def run_migrations(engine):
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "id VARCHAR PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT id FROM schema_migrations"))}
+
+        for name in MIGRATIONS:
+            if name in applied:
+                continue
+            module = importlib.import_module(f"{__name__}.{name}")
+            module.upgrade(conn)
+            conn.execute(text("INSERT INTO schema_migrations (id) VALUES (:id)"), {"id": name})
+            print(f"Applied migration {name}")
@@ -0,0 +1,6 @@
+from app.database import engine
+from app import models
+from app.migrations import run_migrations
+
+models.Base.metadata.create_all(bind=engine)
+run_migrations(engine)
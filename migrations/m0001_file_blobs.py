@@ -0,0 +1,8 @@
+"""Link files to content-addressed blobs (the blobs table itself comes from create_all)."""
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("ALTER TABLE files ADD COLUMN IF NOT EXISTS blob_id UUID REFERENCES blobs(id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_files_blob_id ON files (blob_id)"))
+    conn.execute(text("ALTER TABLE upload_parts ADD COLUMN IF NOT EXISTS sha256 VARCHAR"))
+    # Existing files keep blob_id = NULL and are treated as sole owners of their object
@@ -0,0 +1,17 @@
+"""
+Renames used to copy the object to a new key and store its URL as
+s3://takneek-bucket/<key>, which clients can't fetch. Renames no longer move
+objects, so point those rows back at the public URL of their current key.
+"""
+from sqlalchemy import text
+from app.utils.s3 import get_s3_url
+
+def upgrade(conn):
+    result = conn.execute(
+        text(
+            "UPDATE files SET s3_url = :prefix || s3_path "
+            "WHERE s3_url LIKE 's3://takneek-bucket/%' AND s3_path IS NOT NULL"
+        ),
+        {"prefix": get_s3_url("")},
+    )
+    print(f"Rewrote s3_url for {result.rowcount} renamed files")
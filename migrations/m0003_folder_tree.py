@@ -0,0 +1,42 @@
+"""
+Turn folders into a real tree: parent_id, depth and prefix-friendly indexes
+on (owner_id, drive_path), plus files.folder_id.
+
+create-folder used to store a folder as (drive_path = parent path, name),
+while fileSave and rename-folder store drive_path = the folder's own path.
+Rows of the first kind are rewritten to the second before linking parents.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    "ALTER TABLE folders ADD COLUMN IF NOT EXISTS parent_id UUID REFERENCES folders(id)",
+    "ALTER TABLE folders ADD COLUMN IF NOT EXISTS depth INTEGER",
+    "ALTER TABLE files ADD COLUMN IF NOT EXISTS folder_id UUID REFERENCES folders(id)",
+
+    # drive_path is the folder's own path from now on
+    "UPDATE folders SET drive_path = drive_path || name || '/' "
+    "WHERE right(drive_path, length(name) + 2) <> '/' || name || '/'",
+
+    # The rewrite can produce the same folder twice; keep one row per path
+    "DELETE FROM folders a USING folders b "
+    "WHERE a.owner_id = b.owner_id AND a.drive_path = b.drive_path AND a.id::text > b.id::text",
+
+    "UPDATE folders SET depth = length(drive_path) - length(replace(drive_path, '/', '')) - 1",
+    "ALTER TABLE folders ALTER COLUMN depth SET NOT NULL",
+
+    "UPDATE folders c SET parent_id = p.id FROM folders p "
+    "WHERE c.depth > 1 AND p.owner_id = c.owner_id "
+    "AND p.drive_path = left(c.drive_path, length(c.drive_path) - length(c.name) - 1)",
+
+    "UPDATE files f SET folder_id = p.id FROM folders p "
+    "WHERE f.drive_path <> '/' AND p.owner_id = f.owner_id AND p.drive_path = f.drive_path",
+
+    "CREATE INDEX IF NOT EXISTS ix_folders_owner_drive_path ON folders (owner_id, drive_path text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_files_owner_drive_path ON files (owner_id, drive_path text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_folders_parent_id ON folders (parent_id)",
+    "CREATE INDEX IF NOT EXISTS ix_files_folder_id ON files (folder_id)",
+]
+
+def upgrade(conn):
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
@@ -0,0 +1,5 @@
+"""Per-user change counter used for folder listing ETags."""
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS drive_version BIGINT NOT NULL DEFAULT 0"))
@@ -0,0 +1,8 @@
+"""Soft-delete columns for the trash."""
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("ALTER TABLE files ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP"))
+    conn.execute(text("ALTER TABLE folders ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_files_deleted_at ON files (deleted_at)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_folders_deleted_at ON folders (deleted_at)"))
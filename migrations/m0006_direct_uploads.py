@@ -0,0 +1,9 @@
+"""File status/size/created_at for presigned direct-to-S3 uploads."""
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("ALTER TABLE files ADD COLUMN IF NOT EXISTS status VARCHAR NOT NULL DEFAULT 'ready'"))
+    conn.execute(text("ALTER TABLE files ADD COLUMN IF NOT EXISTS size BIGINT"))
+    conn.execute(text("ALTER TABLE files ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT now()"))
+    # Sizes of deduplicated files are known from their blob
+    conn.execute(text("UPDATE files f SET size = b.size FROM blobs b WHERE f.blob_id = b.id AND f.size IS NULL"))
@@ -0,0 +1,5 @@
+"""Derivative (thumbnail/preview) keys on files."""
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("ALTER TABLE files ADD COLUMN IF NOT EXISTS thumbnails JSON"))
@@ -0,0 +1,8 @@
+"""Last-activity time on resumable upload sessions, so abandoned ones can be aborted."""
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("ALTER TABLE upload_sessions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now()"))
+    # Existing sessions: no per-part times were kept, so count from creation
+    conn.execute(text("UPDATE upload_sessions SET updated_at = created_at"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_upload_sessions_updated_at ON upload_sessions (updated_at)"))
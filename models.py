@@ -1,6 +1,6 @@
 import uuid
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy import Column, DateTime, String, Boolean, ForeignKey, JSON, func, UniqueConstraint
+from sqlalchemy import Column, DateTime, String, Boolean, ForeignKey, JSON, func, UniqueConstraint, Integer, BigInteger, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -11,12 +11,17 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     is_verified = Column(Boolean, default=False)
+    drive_version = Column(BigInteger, nullable=False, default=0, server_default="0")  # bumped on every file/folder change
 
     files = relationship("File", back_populates="owner")
     folders = relationship("Folder", back_populates="owner")
 
 class File(Base):
     __tablename__ = "files"
+    __table_args__ = (
+        # text_pattern_ops lets drive_path LIKE 'prefix%' subtree queries use the index
+        Index("ix_files_owner_drive_path", "owner_id", "drive_path", postgresql_ops={"drive_path": "text_pattern_ops"}),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False)
     original_name = Column(String, nullable=False)
@@ -27,14 +32,97 @@ class File(Base):
     s3_path = Column(String, nullable=True)
     s3_url = Column(String, nullable=True)
     owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
+    blob_id = Column(UUID(as_uuid=True), ForeignKey("blobs.id"), nullable=True, index=True)
+    folder_id = Column(UUID(as_uuid=True), ForeignKey("folders.id"), nullable=True, index=True)  # NULL = root
+    deleted_at = Column(DateTime, nullable=True, index=True)  # set while in the trash
+    status = Column(String, nullable=False, default="ready", server_default="ready")  # "pending" until a direct upload is confirmed
+    size = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    thumbnails = Column(JSON, nullable=True)  # derivative name -> S3 key; NULL until generated
 
     owner = relationship("User", back_populates="files")
+    blob = relationship("Blob", back_populates="files")
+
+class Blob(Base):
+    """
+    Stored content, addressed by its SHA-256. Files with identical content
+    share one Blob (and one S3 object); ref_count tracks how many do.
+    """
+    __tablename__ = "blobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False)
+    sha256 = Column(String, nullable=False, unique=True, index=True)
+    size = Column(BigInteger, nullable=False)
+    content_type = Column(String, nullable=True)
+    stored_name = Column(String, nullable=False)
+    physical_path = Column(String, nullable=False)
+    s3_path = Column(String, nullable=False)
+    s3_url = Column(String, nullable=True)
+    ref_count = Column(Integer, nullable=False, default=1)
+    created_at = Column(DateTime, server_default=func.now())
+
+    files = relationship("File", back_populates="blob")
+
+class UploadSession(Base):
+    """A resumable upload in progress; maps onto one S3 multipart upload."""
+    __tablename__ = "upload_sessions"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False)
+    original_name = Column(String, nullable=False)
+    stored_name = Column(String, nullable=False)
+    drive_path = Column(String, nullable=True)
+    content_type = Column(String, nullable=True)
+    s3_path = Column(String, nullable=False)
+    s3_upload_id = Column(String, nullable=False)
+    part_size = Column(BigInteger, nullable=False)
+    total_size = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), index=True)  # last part received; stale sessions are aborted
+    owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
+
+    parts = relationship("UploadPart", back_populates="session", cascade="all, delete-orphan")
+
+class UploadPart(Base):
+    __tablename__ = "upload_parts"
+    __table_args__ = (UniqueConstraint("session_id", "part_number"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(UUID(as_uuid=True), ForeignKey("upload_sessions.id", ondelete="CASCADE"), nullable=False)
+    part_number = Column(Integer, nullable=False)
+    etag = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    sha256 = Column(String, nullable=True)
+
+    session = relationship("UploadSession", back_populates="parts")
+
 class Folder(Base):
     __tablename__ = "folders"
+    __table_args__ = (
+        Index("ix_folders_owner_drive_path", "owner_id", "drive_path", postgresql_ops={"drive_path": "text_pattern_ops"}),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False)
     name = Column(String, nullable=False)
-    drive_path = Column(String, nullable=True)  # virtual path like "Work/Docs"
+    drive_path = Column(String, nullable=True)  # virtual path like "/Work/Docs/" (the folder's own path)
+    parent_id = Column(UUID(as_uuid=True), ForeignKey("folders.id"), nullable=True, index=True)  # NULL = root
+    depth = Column(Integer, nullable=False, default=1)  # number of path segments, "/Work/Docs/" -> 2
+    deleted_at = Column(DateTime, nullable=True, index=True)  # set while in the trash
     owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
 
     owner = relationship("User", back_populates="folders")
+
+class Job(Base):
+    """Progress of work that runs after the request returns (e.g. purging storage)."""
+    __tablename__ = "jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, nullable=False)
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending / running / done / failed
+    total = Column(Integer, nullable=False, default=0)
+    done = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    failed_items = Column(JSON, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
@@ -1,15 +1,20 @@
 # backend/app/routes/ai.py
-from fastapi import APIRouter, HTTPException, Body
-from app.utils.ai import generate_ai_response
+import json
+from fastapi import APIRouter, HTTPException, Body, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.utils.ai import agenerate_ai_response, stream_ai_response, readiness, is_ready, cache_metrics
+from app.auth import get_current_user
 
 router = APIRouter()
 
 @router.post("/answer")
 async def ai_route(
-    body: dict = Body(...)
+    body: dict = Body(...),
+    user=Depends(get_current_user),
 ):
     """
     API endpoint to get an AI-generated response using RAG with conversation history.
+    Answers draw on the shared documents and the caller's own files.
     Body example:
     {
       "history": [
@@ -23,7 +28,51 @@ async def ai_route(
         history = body.get("history", [])
         query = body.get("query", "")
 
-        response = generate_ai_response(query, history)
+        response = await agenerate_ai_response(query, history, user.id)
         return {"response": response}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def sse(data: dict, event: str | None = None) -> str:
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@router.post("/answer/stream")
+async def ai_stream_route(
+    body: dict = Body(...),
+    user=Depends(get_current_user),
+):
+    """
+    Same body as /ai/answer, answered as server-sent events: one
+    `data: {"token": "..."}` message per piece of the answer as the LLM
+    produces it, then `event: done` (or `event: error` with a detail).
+    """
+    history = body.get("history", [])
+    query = body.get("query", "")
+
+    async def events():
+        try:
+            async for token in stream_ai_response(query, history, user.id):
+                yield sse({"token": token})
+            yield sse({}, event="done")
+        except Exception as e:
+            yield sse({"detail": str(e)}, event="error")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Don't let proxies buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/health")
+def ai_health():
+    """Readiness of the RAG components; 503 until the warm-up has succeeded (it is retried in the background)."""
+    return JSONResponse({"ready": is_ready(), **readiness}, status_code=200 if is_ready() else 503)
+
+@router.get("/cache-metrics")
+def ai_cache_metrics():
+    """Size and hit rate of each RAG cache layer in this process."""
+    return cache_metrics()
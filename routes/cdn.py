@@ -1,17 +1,39 @@
-import os, uuid, io
-from fastapi import UploadFile, File, Depends, APIRouter, HTTPException, Form, Body
-from sqlalchemy.orm import Session
-from PIL import Image
-import pillow_heif
+import os, uuid, hashlib, json, base64, asyncio
+from datetime import datetime, timedelta
+from collections import Counter
+from fastapi import UploadFile, File, Depends, APIRouter, HTTPException, Form, Body, Request, Query, BackgroundTasks
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import String, func, literal, tuple_, and_, select, update
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
 from app import models
-from app.database import get_db
+from app.database import get_async_db, SessionLocal
 from app.auth import get_current_user
-from app.utils.s3 import upload_to_s3, delete_from_s3, rename_in_s3
+from app.utils.s3 import put_bytes_to_s3, delete_from_s3, presign_get, PRESIGNED_URL_EXPIRY, MultipartUpload
+from app.utils.upload import stream_to_s3
+from app.utils.jobs import create_job, job_status, run_delete_job
+from app.utils.cache import LocalFileCache
+from app.utils.derivatives import generate_derivatives, derivative_keys, thumbnail_urls
+from app.utils import indexer
+from app.utils.images import (
+    image_pool, convert_heic, ImagePoolBusy, OUTPUT_FORMATS, IMAGE_OUTPUT_FORMAT, IMAGE_QUALITY,
+)
 import uuid
 from uuid import UUID
 
 router = APIRouter()
 
+# Trashed items are purged this long after deletion, checked every interval
+TRASH_RETENTION_DAYS = int(os.getenv("TRASH_RETENTION_DAYS", 30))
+TRASH_GC_INTERVAL = int(os.getenv("TRASH_GC_INTERVAL_SECONDS", 3600))
+TRASH_GC_BATCH_SIZE = int(os.getenv("TRASH_GC_BATCH_SIZE", 5000))
+# Presigned uploads not confirmed within this many seconds are discarded
+PENDING_UPLOAD_TTL = int(os.getenv("PENDING_UPLOAD_TTL_SECONDS", 24 * 3600))
+# Resumable upload sessions with no part received for this long are aborted
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL_SECONDS", 7 * 24 * 3600))
+
 
 
 #helper functions
@@ -24,93 +46,462 @@ def normalize_file_path(path: str) -> str:
     """Normalize file's drive_path to always end with '/' (represents parent folder)."""
     return normalize_folder_path(path)
 
+def touch_drive(db: Session, owner_id):
+    """
+    Bump the owner's drive_version (part of listing ETags) in the current
+    transaction. Call it before committing any change to files or folders.
+    """
+    db.query(models.User).filter(models.User.id == owner_id).update(
+        {models.User.drive_version: models.User.drive_version + 1}, synchronize_session=False
+    )
+
+def folder_depth(path: str) -> int:
+    """Number of segments in a folder path, "/" -> 0, "/Work/Docs/" -> 2."""
+    path = path.strip("/")
+    return len(path.split("/")) if path else 0
+
+def ensure_parent_folders(db: Session, owner_id, drive_path: str, created: list | None = None):
+    """
+    Create every missing folder along drive_path for the given owner and
+    return the deepest one (None for the root). All ancestors are looked up
+    with a single indexed query. New folders are appended to `created`.
+    """
+    drive_path = drive_path.strip("/")
+    if not drive_path:
+        return None
+
+    parts = drive_path.split("/")
+    paths = [normalize_folder_path("/".join(parts[:i + 1])) for i in range(len(parts))]
+
+    existing = {
+        f.drive_path: f
+        for f in db.query(models.Folder).filter(
+            models.Folder.owner_id == owner_id,
+            models.Folder.drive_path.in_(paths),
+            models.Folder.deleted_at.is_(None)
+        ).all()
+    }
+
+    parent = None
+    for depth, (part, path) in enumerate(zip(parts, paths), start=1):
+        folder = existing.get(path)
+        if not folder:
+            folder = models.Folder(
+                name=part,
+                drive_path=path,
+                parent_id=parent.id if parent else None,
+                depth=depth,
+                owner_id=owner_id,
+            )
+            db.add(folder)
+            touch_drive(db, owner_id)
+            db.commit()
+            db.refresh(folder)
+            if created is not None:
+                created.append(folder)
+        parent = folder
+
+    return parent
+
+def restore_parent_folders(db: Session, owner_id, drive_path: str):
+    """
+    Like ensure_parent_folders, but a missing folder that is still in the
+    trash is restored (the most recently trashed one at that path) instead
+    of being recreated next to it, so restoring it later can't clash with
+    a new folder. Only the folder row comes back; the rest of what was
+    trashed with it stays in the trash and is listed there on its own.
+    """
+    drive_path = drive_path.strip("/")
+    if not drive_path:
+        return None
+
+    parts = drive_path.split("/")
+    paths = [normalize_folder_path("/".join(parts[:i + 1])) for i in range(len(parts))]
+
+    live = {
+        f.drive_path: f
+        for f in db.query(models.Folder).filter(
+            models.Folder.owner_id == owner_id,
+            models.Folder.drive_path.in_(paths),
+            models.Folder.deleted_at.is_(None)
+        ).all()
+    }
+
+    parent = None
+    for path in paths:
+        folder = live.get(path)
+        if folder is None:
+            folder = db.query(models.Folder).filter(
+                models.Folder.owner_id == owner_id,
+                models.Folder.drive_path == path,
+                models.Folder.deleted_at.isnot(None)
+            ).order_by(models.Folder.deleted_at.desc()).first()
+            if folder is not None:
+                folder.deleted_at = None
+                folder.parent_id = parent.id if parent else None
+                touch_drive(db, owner_id)
+                db.commit()
+            else:
+                # Every ancestor exists by now, so this creates just the one folder
+                folder = ensure_parent_folders(db, owner_id, path)
+        parent = folder
+
+    return parent
+
+def ensure_unique_file_name(db: Session, owner_id, drive_path: str, original_name: str):
+    """Raise 400 if a file with the same name already exists in the folder."""
+    existing_file = (
+        db.query(models.File)
+        .filter(
+            models.File.owner_id == owner_id,
+            models.File.drive_path == normalize_folder_path(drive_path),
+            models.File.original_name == original_name,
+            models.File.deleted_at.is_(None),
+        )
+        .first()
+    )
+    if existing_file:
+        raise HTTPException(status_code=400, detail="File with same name already exists in this folder.")
+
+def ensure_folder_path_free(db: Session, owner_id, folder_path: str):
+    """Raise 400 if a folder already exists at folder_path."""
+    existing = db.query(models.Folder.id).filter(
+        models.Folder.owner_id == owner_id,
+        models.Folder.drive_path == folder_path,
+        models.Folder.deleted_at.is_(None)
+    ).first()
+    if existing:
+        raise HTTPException(status_code=400, detail="Folder already exists")
+
+def move_folder_subtree(db: Session, owner_id, old_path: str, new_path: str) -> tuple[dict, list]:
+    """
+    Re-prefix drive_path for a folder, its subfolders and their files with
+    one UPDATE per table (new_path || substr(drive_path, len(old_path) + 1)).
+    Folder depths shift along with the path; parent_id links inside the
+    subtree stay valid. Trashed rows keep their old path. Rows are not
+    loaded into the session; the caller commits (and re-parents the
+    subtree root on a move). Returns the counts and the moved files' ids.
+    """
+    def reprefix(column):
+        return literal(new_path, String) + func.substr(column, len(old_path) + 1)
+
+    depth_change = folder_depth(new_path) - folder_depth(old_path)
+
+    folders_updated = db.query(models.Folder).filter(
+        models.Folder.owner_id == owner_id,
+        models.Folder.drive_path.startswith(old_path, autoescape=True),
+        models.Folder.deleted_at.is_(None)
+    ).update({
+        models.Folder.drive_path: reprefix(models.Folder.drive_path),
+        models.Folder.depth: models.Folder.depth + depth_change,
+    }, synchronize_session=False)
+
+    file_ids = db.execute(
+        update(models.File).where(
+            models.File.owner_id == owner_id,
+            models.File.drive_path.startswith(old_path, autoescape=True),
+            models.File.deleted_at.is_(None)
+        ).values(drive_path=reprefix(models.File.drive_path)).returning(models.File.id),
+        execution_options={"synchronize_session": False},
+    ).scalars().all()
+
+    return {"folders_updated": folders_updated, "files_updated": len(file_ids)}, file_ids
+
+def find_blob(db: Session, sha256: str, lock: bool = False):
+    query = db.query(models.Blob).filter(models.Blob.sha256 == sha256)
+    if lock:
+        # Blocks a concurrent release_blobs until the caller commits
+        query = query.with_for_update()
+    return query.first()
+
+def remove_stored_object(physical_path: str | None, s3_path: str | None):
+    """Delete the local copy and the S3 object backing a file or blob."""
+    if physical_path and os.path.exists(physical_path):
+        os.remove(physical_path)
+    if s3_path:
+        delete_from_s3(s3_path)
+
+def attach_blob(db: Session, new_file: models.File, sha256: str, size: int):
+    """
+    Point new_file at the blob holding its content.
+
+    If the content is new, new_file's own object becomes the blob. If it is
+    already stored, new_file takes over the blob's storage fields and the
+    blob's ref_count goes up. Works for new and already-persisted files.
+    The blob row is locked, so it can't be purged between the lookup and
+    the ref_count update.
+    """
+    blob = find_blob(db, sha256, lock=True)
+    if blob is None and new_file.s3_url is None:
+        # The content matched a blob that was deleted before we could use it
+        raise HTTPException(status_code=409, detail="Upload conflicted with a delete, please retry.")
+    if blob is None:
+        blob = models.Blob(
+            sha256=sha256,
+            size=size,
+            content_type=new_file.content_type,
+            stored_name=new_file.stored_name,
+            physical_path=new_file.physical_path,
+            s3_path=new_file.s3_path,
+            s3_url=new_file.s3_url,
+            ref_count=1,
+        )
+        try:
+            # Savepoint, so losing the race below keeps the caller's other changes
+            with db.begin_nested():
+                db.add(blob)
+            new_file.blob = blob
+            return
+        except IntegrityError:
+            # A concurrent upload stored the same content first; drop our copy
+            remove_stored_object(new_file.physical_path, new_file.s3_path)
+            blob = find_blob(db, sha256, lock=True)
+            if blob is None:
+                # ...and it was already purged again
+                raise HTTPException(status_code=409, detail="Upload conflicted with a delete, please retry.")
+
+    blob.ref_count = models.Blob.ref_count + 1
+    new_file.blob = blob
+    new_file.stored_name = blob.stored_name
+    new_file.physical_path = blob.physical_path
+    new_file.s3_path = blob.s3_path
+    new_file.s3_url = blob.s3_url
+
+def release_blobs(db: Session, files) -> tuple[list, list]:
+    """
+    Drop the blob references held by files that are being deleted for good
+    (rows only need blob_id, physical_path, s3_path and thumbnails). Every affected blob
+    is locked and decremented with one query; files uploaded before
+    deduplication (blob_id NULL) own their object outright. Returns the (physical_path, s3_path) pairs nothing
+    uses anymore and the ids of blobs whose last reference went away; the
+    caller deletes those blob rows after the file rows.
+    """
+    orphaned = [(f.physical_path, f.s3_path) for f in files if f.blob_id is None]
+    orphaned += [(None, key) for f in files if f.blob_id is None for key in derivative_keys(f.thumbnails)]
+    refs = Counter(f.blob_id for f in files if f.blob_id is not None)
+    dead_blob_ids = []
+    # Files sharing a blob share its derivatives, so any of them has the keys
+    blob_thumbnails = {f.blob_id: f.thumbnails for f in files if f.blob_id is not None and f.thumbnails}
+
+    if refs:
+        # Locked in id order, so concurrent purges can't deadlock on each other
+        blobs = db.query(models.Blob).filter(models.Blob.id.in_(refs)).order_by(models.Blob.id).with_for_update().all()
+        for blob in blobs:
+            blob.ref_count -= refs[blob.id]
+            if blob.ref_count <= 0:
+                orphaned.append((blob.physical_path, blob.s3_path))
+                orphaned += [(None, key) for key in derivative_keys(blob_thumbnails.get(blob.id))]
+                dead_blob_ids.append(blob.id)
+        db.flush()
+
+    return orphaned, dead_blob_ids
+
+def purge_trashed(db: Session, owner_id=None, older_than: datetime | None = None, batch_size: int | None = None):
+    """
+    Permanently delete trashed rows, optionally only one owner's and/or only
+    those trashed before older_than. With batch_size, at most that many
+    files are purged and folders are left for the final batch. File rows
+    locked by a concurrent purge are skipped either way.
+
+    Returns the (physical_path, s3_path) pairs nothing uses anymore and the
+    number of files purged. The caller commits, then removes the objects.
+    """
+    file_filters = [models.File.deleted_at.isnot(None)]
+    folder_filters = [models.Folder.deleted_at.isnot(None)]
+    if owner_id is not None:
+        file_filters.append(models.File.owner_id == owner_id)
+        folder_filters.append(models.Folder.owner_id == owner_id)
+    if older_than is not None:
+        file_filters.append(models.File.deleted_at < older_than)
+        folder_filters.append(models.Folder.deleted_at < older_than)
+
+    query = db.query(
+        models.File.id, models.File.blob_id, models.File.physical_path, models.File.s3_path, models.File.thumbnails,
+    ).filter(*file_filters)
+    if batch_size:
+        query = query.limit(batch_size)
+    # Rows another purge (empty-trash or the collector) holds are left to it,
+    # so each file releases its blob exactly once
+    files = query.with_for_update(skip_locked=True).all()
+
+    orphaned, dead_blob_ids = release_blobs(db, files)
+    if files:
+        db.query(models.File).filter(models.File.id.in_([f.id for f in files])).delete(synchronize_session=False)
+    if dead_blob_ids:
+        db.query(models.Blob).filter(models.Blob.id.in_(dead_blob_ids)).delete(synchronize_session=False)
+
+    if not batch_size or len(files) < batch_size:
+        # Detach anything still pointing at the purged folders, then drop them
+        purged_folders = db.query(models.Folder.id).filter(*folder_filters).scalar_subquery()
+        db.query(models.Folder).filter(models.Folder.parent_id.in_(purged_folders)).update(
+            {models.Folder.parent_id: None}, synchronize_session=False
+        )
+        db.query(models.File).filter(models.File.folder_id.in_(purged_folders)).update(
+            {models.File.folder_id: None}, synchronize_session=False
+        )
+        db.query(models.Folder).filter(*folder_filters).delete(synchronize_session=False)
+
+    return orphaned, len(files)
+
+def abort_stale_upload_sessions(db: Session) -> int:
+    """
+    Abort the S3 multipart uploads of resumable sessions idle for
+    UPLOAD_SESSION_TTL (S3 bills their parts until then) and delete the
+    sessions with their parts, in batches. Sessions whose abort fails are
+    kept for the next run.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=UPLOAD_SESSION_TTL)
+    aborted = 0
+    while True:
+        sessions = db.query(models.UploadSession).filter(
+            func.coalesce(models.UploadSession.updated_at, models.UploadSession.created_at) < cutoff
+        ).order_by(models.UploadSession.updated_at).limit(TRASH_GC_BATCH_SIZE).with_for_update(skip_locked=True).all()
+        gone = [s.id for s in sessions if MultipartUpload(s.s3_path, s.content_type, upload_id=s.s3_upload_id).abort()]
+        if gone:
+            db.query(models.UploadPart).filter(models.UploadPart.session_id.in_(gone)).delete(synchronize_session=False)
+            db.query(models.UploadSession).filter(models.UploadSession.id.in_(gone)).delete(synchronize_session=False)
+        db.commit()
+        aborted += len(gone)
+        if len(sessions) < TRASH_GC_BATCH_SIZE or not gone:
+            return aborted
+
+def collect_expired_trash():
+    """
+    Purge everything trashed more than TRASH_RETENTION_DAYS ago, in batches.
+    Direct uploads never confirmed within PENDING_UPLOAD_TTL are trashed first,
+    and abandoned resumable uploads are aborted.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=TRASH_RETENTION_DAYS)
+    db = SessionLocal()
+    try:
+        db.query(models.File).filter(
+            models.File.status == "pending",
+            models.File.deleted_at.is_(None),
+            models.File.created_at < datetime.utcnow() - timedelta(seconds=PENDING_UPLOAD_TTL),
+        ).update({models.File.deleted_at: datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+
+        aborted = abort_stale_upload_sessions(db)
+        if aborted:
+            print(f"Aborted {aborted} abandoned upload session(s)")
+
+        while True:
+            orphaned, files_purged = purge_trashed(db, older_than=cutoff, batch_size=TRASH_GC_BATCH_SIZE)
+            job_id = create_job(db, "trash-gc", None, total=len(orphaned)).id if orphaned else None
+            db.commit()
+            if job_id:
+                run_delete_job(job_id, orphaned)
+            if files_purged < TRASH_GC_BATCH_SIZE:
+                break
+    finally:
+        db.close()
+
+async def run_trash_collector():
+    """Started from main.py: run collect_expired_trash every TRASH_GC_INTERVAL seconds."""
+    while True:
+        try:
+            await run_in_threadpool(collect_expired_trash)
+        except Exception as e:
+            print("Trash collection failed:", e)
+        await asyncio.sleep(TRASH_GC_INTERVAL)
+
 
 # Absolute path for store folder
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STORE_DIR = os.path.join(BASE_DIR, "store")
 os.makedirs(STORE_DIR, exist_ok=True)
 
+# Whether uploads are also kept in STORE_DIR next to the S3 copy
+KEEP_LOCAL_COPY = os.getenv("KEEP_LOCAL_COPY", "true").lower() == "true"
+
+# STORE_DIR doubles as a read-through cache for downloads, kept under this budget
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", 10 * 1024 ** 3))
+local_cache = LocalFileCache(STORE_DIR, LOCAL_CACHE_MAX_BYTES)
+
+# New content is stored under this prefix, locally and in S3
+BLOB_PREFIX = os.getenv("BLOB_PREFIX", "blobs")
+os.makedirs(os.path.join(STORE_DIR, BLOB_PREFIX), exist_ok=True)
+
+def new_stored_object(ext: str) -> tuple[str, str, str]:
+    """
+    Stored name, local path and S3 key for newly uploaded content. Blobs are
+    shared by every owner of the same content, so none of them carries the
+    uploader's id or file name.
+    """
+    stored_name = f"{uuid.uuid4().hex}{ext}"
+    return stored_name, os.path.join(STORE_DIR, BLOB_PREFIX, stored_name), f"{BLOB_PREFIX}/{stored_name}"
+
 @router.post("/fileSave")
 async def fileSave(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     drive_path: str = Form(""),
+    image_format: str = Form(None),
+    image_quality: int = Form(None),
     user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    # Ensure user-specific folder in local storage
-    user_folder = os.path.join(STORE_DIR, str(user.id))
-    os.makedirs(user_folder, exist_ok=True)
+    # HEIC uploads are converted to image_format (JPEG, WEBP or AVIF)
+    image_format = (image_format or IMAGE_OUTPUT_FORMAT).upper()
+    if image_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"image_format must be one of {', '.join(OUTPUT_FORMATS)}")
+    image_quality = image_quality or IMAGE_QUALITY
+    if not 1 <= image_quality <= 100:
+        raise HTTPException(status_code=400, detail="image_quality must be between 1 and 100")
 
     # Ensure drive_path is normalized (no leading/trailing slashes)
     drive_path = drive_path.strip("/")
 
     # --- Ensure parent folders exist virtually ---
-    if drive_path:
-        parts = drive_path.split("/")
-        current_path = ""
-        for part in parts:
-            current_path = f"{current_path}/{part}" if current_path else part
-
-            existing_folder = (
-                db.query(models.Folder)
-                .filter(models.Folder.owner_id == user.id, models.Folder.drive_path == normalize_folder_path(current_path))
-                .first()
-            )
-
-            if not existing_folder:
-                new_folder = models.Folder(
-                    name=part,
-                    drive_path=normalize_folder_path(current_path),
-                    owner_id=user.id,
-                )
-                db.add(new_folder)
-                db.commit()
-                db.refresh(new_folder)
+    parent_folder = await db.run_sync(ensure_parent_folders, user.id, drive_path)
 
     # Original filename
     original_filename = file.filename
-    name, ext = os.path.splitext(original_filename)
+    ext = os.path.splitext(original_filename)[1]
     file_type = file.content_type
 
     # --- Check duplicate filename in same folder ---
-    existing_file = (
-        db.query(models.File)
-        .filter(
-            models.File.owner_id == user.id,
-            models.File.drive_path == normalize_folder_path(drive_path),
-            models.File.original_name == original_filename,
-        )
-        .first()
-    )
-    if existing_file:
-        raise HTTPException(status_code=400, detail="File with same name already exists in this folder.")
+    await db.run_sync(ensure_unique_file_name, user.id, drive_path, original_filename)
 
     # Generate unique filename
-    unique_filename = f"{name}_{uuid.uuid4().hex}{ext}"
-    file_path = os.path.join(user_folder, unique_filename)
-
-    # Read file into memory once
-    file_bytes = await file.read()
+    unique_filename, file_path, s3_key = new_stored_object(ext)
 
-    # Handle HEIC → JPG conversion
+    # Handle HEIC conversion (needs the whole image in memory). Decoding and
+    # encoding run in the image process pool, off the event loop.
     if file_type in ["image/heic", "image/heif"]:
-        heif_file = pillow_heif.read_heif(io.BytesIO(file_bytes))
-        image = Image.frombytes(
-            heif_file.mode, heif_file.size, heif_file.data,
-            "raw", heif_file.mode, heif_file.stride,
-        )
-        unique_filename = f"{name}_{uuid.uuid4().hex}.jpg"
-        file_path = os.path.join(user_folder, unique_filename)
-        image.save(file_path, "JPEG")
-        file_type = "image/jpeg"
+        file_bytes = await file.read()
+        try:
+            image_bytes = await image_pool.submit(convert_heic, file_bytes, image_format, image_quality)
+        except ImagePoolBusy:
+            raise HTTPException(status_code=429, detail="Too many image conversions in progress, try again shortly", headers={"Retry-After": "5"})
+        except Exception as e:
+            print(f"HEIC conversion failed for {original_filename}: {e}")
+            raise HTTPException(status_code=400, detail="Could not convert image")
+        extension, file_type = OUTPUT_FORMATS[image_format]
+        unique_filename, file_path, s3_key = new_stored_object(extension)
+        sha256 = hashlib.sha256(image_bytes).hexdigest()
+        size = len(image_bytes)
+
+        s3_url = None
+        if not await db.run_sync(find_blob, sha256):
+            if KEEP_LOCAL_COPY:
+                with open(file_path, "wb") as f:
+                    f.write(image_bytes)
+                await run_in_threadpool(local_cache.add, file_path)
+            s3_url = await run_in_threadpool(put_bytes_to_s3, image_bytes, file_type, s3_key)
     else:
-        # Normal file save
-        with open(file_path, "wb") as f:
-            f.write(file_bytes)
-
-    # Upload to S3
-    s3_key = f"{user.id}/{unique_filename}"
-    s3_url = upload_to_s3(file_path, file_type, s3_key)
+        # Stream the upload straight into S3 (and the local store, if enabled),
+        # skipping the store when the same content is already there
+        result = await stream_to_s3(
+            file, s3_key, file_type,
+            local_path=file_path if KEEP_LOCAL_COPY else None,
+            is_known=lambda digest: db.run_sync(find_blob, digest),
+        )
+        s3_url = result["s3_url"]
+        sha256 = result["sha256"]
+        size = result["size"]
+        if KEEP_LOCAL_COPY and not result["duplicate"]:
+            await run_in_threadpool(local_cache.add, file_path)
 
     # Save record in DB
     new_file = models.File(
@@ -121,36 +512,42 @@ async def fileSave(
         content_type=file_type,
         s3_path=s3_key,
         s3_url=s3_url,
+        size=size,
+        folder_id=parent_folder.id if parent_folder else None,
         owner_id=user.id
     )
+    await db.run_sync(attach_blob, new_file, sha256, size)
     db.add(new_file)
-    db.commit()
-    db.refresh(new_file)
+    await db.run_sync(touch_drive, user.id)
+    await db.commit()
+    await db.refresh(new_file)
+    background_tasks.add_task(generate_derivatives, new_file.id)
+    await indexer.publish([new_file.id], "upload")
 
     return {
         "message": "File saved successfully",
         "file_id": new_file.id,
         "original_filename": original_filename,
-        "stored_filename": unique_filename,
         "drive_path": normalize_folder_path(drive_path),
-        "s3_url": s3_url,
-        "local_path": file_path
     }
 
 
 @router.get("/my-files")
-def get_user_files(user=Depends(get_current_user), db: Session = Depends(get_db)):
-    files = db.query(models.File).filter(models.File.owner_id == user.id).all()
-    folders = db.query(models.Folder).filter(models.Folder.owner_id == user.id).all()
+async def get_user_files(user=Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    files = (await db.execute(select(models.File).where(
+        models.File.owner_id == user.id, models.File.deleted_at.is_(None), models.File.status == "ready"
+    ))).scalars().all()
+    folders = (await db.execute(select(models.Folder).where(
+        models.Folder.owner_id == user.id, models.Folder.deleted_at.is_(None)
+    ))).scalars().all()
 
     return {"files":[
         {
             "id": str(f.id),
             "original_name": f.original_name,
-            "stored_name": f.stored_name,
             "drive_path": f.drive_path or "",
-            "s3_url": f.s3_url,
             "content_type": f.content_type,
+            "thumbnails": thumbnail_urls(f.thumbnails),
         }
         for f in files
     ],"folder":[
@@ -164,59 +561,140 @@ def get_user_files(user=Depends(get_current_user), db: Session = Depends(get_db)
     }
 
 
-@router.put("/rename-file/{file_id}")
-def rename_file(file_id: UUID, new_file_name: str = Body(..., embed=True), user=Depends(get_current_user), db: Session = Depends(get_db)):
-    # Fetch file entry from DB
-    file_entry = db.query(models.File).filter(models.File.id == file_id, models.File.owner_id == user.id).first()
-    if not file_entry:
-        raise HTTPException(status_code=404, detail="File not found")
+# Page size limits for /files/list
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
 
-    # Extract file extension
-    name, ext = os.path.splitext(new_file_name)
-    if not ext:
-        _, old_ext = os.path.splitext(file_entry.original_name)
-        ext = old_ext  # preserve old extension if not given
+def encode_cursor(kind: str, name: str, item_id) -> str:
+    raw = json.dumps({"k": kind, "n": name, "i": str(item_id)}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-    # Generate unique filename
-    unique_filename = f"{name}_{uuid.uuid4().hex}{ext}"
+def decode_cursor(cursor: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        if data["k"] not in ("folder", "file"):
+            raise ValueError(data["k"])
+        data["i"] = UUID(data["i"])
+        return data
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/list")
+async def list_folder(
+    request: Request,
+    path: str = Query("/"),
+    cursor: str | None = Query(None),
+    limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    List one folder: its subfolders first, then its files, both ordered by
+    name. Pages are keyset-paginated; pass back `next_cursor` to continue.
+
+    The ETag is derived from the owner's drive_version, so a client sending
+    If-None-Match gets a 304 without any rows being read.
+    """
+    path = normalize_folder_path(path)
 
-    # --- Local rename (if file is stored locally) ---
-    old_path = file_entry.physical_path
-    new_path = os.path.join(os.path.dirname(old_path), unique_filename)
+    version = await db.scalar(select(models.User.drive_version).where(models.User.id == user.id))
+    etag = '"' + hashlib.sha1(f"{user.id}:{version}:{path}:{cursor}:{limit}".encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
 
-    try:
-        if os.path.exists(old_path):
-            os.rename(old_path, new_path)
+    after = decode_cursor(cursor) if cursor else None
+    folders, files = [], []
+
+    # ---- Subfolders (skipped once the cursor has moved on to files) ----
+    if after is None or after["k"] == "folder":
+        query = select(models.Folder.id, models.Folder.name, models.Folder.drive_path).where(
+            models.Folder.owner_id == user.id,
+            models.Folder.drive_path.startswith(path, autoescape=True),
+            models.Folder.depth == folder_depth(path) + 1,
+            models.Folder.deleted_at.is_(None),
+        )
+        if after:
+            query = query.where(tuple_(models.Folder.name, models.Folder.id) > tuple_(after["n"], after["i"]))
+        folders = (await db.execute(query.order_by(models.Folder.name, models.Folder.id).limit(limit + 1))).all()
+
+    # ---- Files fill whatever is left of the page ----
+    remaining = limit + 1 - len(folders)
+    if remaining > 0:
+        query = select(
+            models.File.id, models.File.original_name, models.File.drive_path,
+            models.File.content_type, models.File.size, models.File.thumbnails,
+        ).where(
+            models.File.owner_id == user.id,
+            models.File.drive_path == path,
+            models.File.deleted_at.is_(None),
+            models.File.status == "ready",
+        )
+        if after and after["k"] == "file":
+            query = query.where(tuple_(models.File.original_name, models.File.id) > tuple_(after["n"], after["i"]))
+        files = (await db.execute(query.order_by(models.File.original_name, models.File.id).limit(remaining))).all()
+
+    # One extra row was fetched to know whether another page exists
+    next_cursor = None
+    if len(folders) + len(files) > limit:
+        if files:
+            files = files[:-1]
+        else:
+            folders = folders[:-1]
+        if files:
+            next_cursor = encode_cursor("file", files[-1].original_name, files[-1].id)
         else:
-            print(f"Local file not found: {old_path}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error renaming local file: {str(e)}")
+            next_cursor = encode_cursor("folder", folders[-1].name, folders[-1].id)
+
+    body = {
+        "path": path,
+        "folders": [
+            {"id": str(f.id), "name": f.name, "drive_path": f.drive_path}
+            for f in folders
+        ],
+        "files": [
+            {
+                "id": str(f.id),
+                "original_name": f.original_name,
+                "drive_path": f.drive_path,
+                "content_type": f.content_type,
+                "size": f.size,
+                "thumbnails": thumbnail_urls(f.thumbnails),
+            }
+            for f in files
+        ],
+        "next_cursor": next_cursor,
+    }
+    return JSONResponse(body, headers=headers)
 
-    # --- S3 rename (actually copy+delete) ---
-    old_s3_key = file_entry.s3_path
-    new_s3_key = f"{user.id}/{unique_filename}"
-    new_s3_url=f"s3://takneek-bucket/{user.id}/{unique_filename}"
 
-    rename_in_s3(old_s3_key,new_s3_key)
+@router.put("/rename-file/{file_id}")
+async def rename_file(file_id: UUID, new_file_name: str = Body(..., embed=True), user=Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    # Fetch file entry from DB
+    file_entry = await db.scalar(select(models.File).where(
+        models.File.id == file_id, models.File.owner_id == user.id, models.File.deleted_at.is_(None)
+    ))
+    if not file_entry:
+        raise HTTPException(status_code=404, detail="File not found")
 
-    # --- Update DB ---
+    # The storage key is independent of the display name, so renaming
+    # never touches the local store or S3
     file_entry.original_name = new_file_name
-    file_entry.stored_name = unique_filename
-    file_entry.physical_path = new_path
-    file_entry.s3_url=new_s3_url
-    file_entry.s3_path = new_s3_key
 
-    db.commit()
-    db.refresh(file_entry)
+    await db.run_sync(touch_drive, user.id)
+    await db.commit()
+    await db.refresh(file_entry)
+    await indexer.publish([file_entry.id], "rename")
 
     return {"message": "File renamed successfully", "file": file_entry}
 
 @router.put("/rename-folder")
-def rename_folder(
+async def rename_folder(
     old_folder_path: str = Body(..., embed=True),
     new_folder_name: str = Body(..., embed=True),
     user=Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Rename a virtual folder by updating drive_path in both Folder and File tables.
@@ -228,10 +706,11 @@ def rename_folder(
 
 
     # ---- Find the folder being renamed ----
-    folder = db.query(models.Folder).filter(
+    folder = await db.scalar(select(models.Folder).where(
         models.Folder.owner_id == user.id,
-        models.Folder.drive_path == old_folder_path
-    ).first()
+        models.Folder.drive_path == old_folder_path,
+        models.Folder.deleted_at.is_(None)
+    ))
 
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not found")
@@ -242,177 +721,341 @@ def rename_folder(
         parent_path += "/"
 
     new_folder_path = normalize_folder_path(f"{parent_path}{new_folder_name}")
+    if new_folder_path != old_folder_path:
+        await db.run_sync(ensure_folder_path_free, user.id, new_folder_path)
+
+    # ---- Rewrite the whole subtree in one transaction ----
+    counts, moved_file_ids = await db.run_sync(move_folder_subtree, user.id, old_folder_path, new_folder_path)
+    await db.execute(
+        update(models.Folder).where(models.Folder.id == folder.id).values(name=new_folder_name),
+        execution_options={"synchronize_session": False},
+    )
+    await db.run_sync(touch_drive, user.id)
+    await db.commit()
+    await indexer.publish(moved_file_ids, "rename-folder")
 
-    # ---- Update the folder itself ----
-    folder.drive_path = new_folder_path
-    folder.name = new_folder_name  # assuming Folder table has `name`
+    return {
+        "message": "Folder renamed successfully",
+        "new_folder_path": new_folder_path,
+        **counts,
+    }
 
-    # ---- Update all subfolders ----
-    subfolders = db.query(models.Folder).filter(
-        models.Folder.owner_id == user.id,
-        models.Folder.drive_path.startswith(old_folder_path),
-        models.Folder.drive_path != old_folder_path
-    ).all()
+@router.put("/move-folder")
+async def move_folder(
+    folder_path: str = Body(..., embed=True),
+    new_parent_path: str = Body(..., embed=True),
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Move a virtual folder (with everything below it) under another folder.
+    Like rename, only drive_path values change.
+    """
+    folder_path = normalize_folder_path(folder_path)
+    new_parent_path = normalize_folder_path(new_parent_path)
 
-    for sf in subfolders:
-        sf.drive_path = sf.drive_path.replace(old_folder_path, new_folder_path, 1)
+    folder = await db.scalar(select(models.Folder).where(
+        models.Folder.owner_id == user.id,
+        models.Folder.drive_path == folder_path,
+        models.Folder.deleted_at.is_(None)
+    ))
 
-    # ---- Update all files inside this folder ----
-    files = db.query(models.File).filter(
-        models.File.owner_id == user.id,
-        models.File.drive_path.startswith(old_folder_path)
-    ).all()
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not found")
 
-    for f in files:
-        f.drive_path = f.drive_path.replace(old_folder_path, new_folder_path, 1)
+    if new_parent_path.startswith(folder_path):
+        raise HTTPException(status_code=400, detail="Cannot move a folder into itself")
 
-    db.commit()
+    parent = None
+    if new_parent_path != "/":
+        parent = await db.scalar(select(models.Folder).where(
+            models.Folder.owner_id == user.id,
+            models.Folder.drive_path == new_parent_path,
+            models.Folder.deleted_at.is_(None)
+        ))
+        if not parent:
+            raise HTTPException(status_code=404, detail="Destination folder not found")
+
+    new_folder_path = normalize_folder_path(f"{new_parent_path}{folder.name}")
+    if new_folder_path != folder_path:
+        await db.run_sync(ensure_folder_path_free, user.id, new_folder_path)
+
+    counts, moved_file_ids = await db.run_sync(move_folder_subtree, user.id, folder_path, new_folder_path)
+    await db.execute(
+        update(models.Folder).where(models.Folder.id == folder.id).values(parent_id=parent.id if parent else None),
+        execution_options={"synchronize_session": False},
+    )
+    await db.run_sync(touch_drive, user.id)
+    await db.commit()
+    await indexer.publish(moved_file_ids, "move-folder")
 
     return {
-        "message": "Folder renamed successfully",
-        "new_folder_path": new_folder_path
+        "message": "Folder moved successfully",
+        "new_folder_path": new_folder_path,
+        **counts,
     }
 
 @router.delete("/delete-file/{file_id}")
-def delete_file(file_id: UUID, user=Depends(get_current_user), db: Session = Depends(get_db)):
-    file = db.query(models.File).filter(models.File.id == file_id, models.File.owner_id == user.id).first()
+async def delete_file(file_id: UUID, user=Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    """
+    Move a file to the trash. Its stored object is removed by the trash
+    collector once TRASH_RETENTION_DAYS have passed.
+    """
+    file = await db.scalar(select(models.File).where(
+        models.File.id == file_id, models.File.owner_id == user.id, models.File.deleted_at.is_(None)
+    ))
 
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
 
-    # Delete from local storage
-    local_path = os.path.join(STORE_DIR, str(user.id), file.stored_name)
-    if os.path.exists(local_path):
-        os.remove(local_path)
-
-    # Delete from S3
-    if file.s3_path:
-        try:
-            delete_from_s3(file.s3_path)
-        except Exception as e:
-            print("S3 delete failed:", e)
-
-    # Delete from DB
-    db.delete(file)
-    db.commit()
+    file.deleted_at = datetime.utcnow()
+    await db.run_sync(touch_drive, user.id)
+    await db.commit()
+    await indexer.publish([file_id], "delete")
 
-    return {"message": "File deleted successfully"}
+    return {"message": "File moved to trash"}
 
 
 @router.post("/create-folder")
-def create_folder(
+async def create_folder(
     folder_name: str = Body(..., embed=True),
     parent_path: str = Body(..., embed=True),
     user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    # Split parent path into parts
-    parent_path = parent_path.strip("/")
-    print("parent_path is",parent_path)
-    parts = parent_path.split("/") if parent_path else []
-
-    current_path = "/"
-    created_folders = []
-    part_being_checked_parent_path="/"
-
-    for idx, part_being_checked in enumerate(parts):
-
-        existing = db.query(models.Folder).filter(
-            models.Folder.owner_id == user.id,
-            models.Folder.name == part_being_checked
-        ).first()
-
-        if not existing:
-            folder = models.Folder(
-                name=part_being_checked,
-                drive_path=part_being_checked_parent_path,
-                owner_id=user.id
-            )
-            db.add(folder)
-            db.commit()
-            db.refresh(folder)
-            created_folders.append({"id": str(folder.id), "drive_path": folder.drive_path})
-
-        part_being_checked_parent_path=normalize_folder_path(part_being_checked_parent_path+part_being_checked)
-        current_path=normalize_folder_path(current_path+part_being_checked)
+    # Make sure every folder along parent_path exists
+    created = []
+    parent = await db.run_sync(ensure_parent_folders, user.id, parent_path, created)
 
-    # Final folder
-    if current_path == "/":
-        final_path = f"/"
-    else:
-        final_path = current_path
-
-    existing = db.query(models.Folder).filter(
-        models.Folder.owner_id == user.id,
-        models.Folder.drive_path == final_path,
-        models.Folder.name == folder_name
-    ).first()
-
-    if existing:
-        raise HTTPException(status_code=400, detail="Folder already exists")
+    folder_path = normalize_folder_path(f"{parent_path.strip('/')}/{folder_name}")
+    await db.run_sync(ensure_folder_path_free, user.id, folder_path)
 
     folder = models.Folder(
         name=folder_name,
-        drive_path=final_path,
+        drive_path=folder_path,
+        parent_id=parent.id if parent else None,
+        depth=folder_depth(folder_path),
         owner_id=user.id
     )
     db.add(folder)
-    db.commit()
-    db.refresh(folder)
-    created_folders.append({"id": str(folder.id), "drive_path": folder.drive_path})
+    await db.run_sync(touch_drive, user.id)
+    await db.commit()
+    await db.refresh(folder)
+    created.append(folder)
 
     return {
         "message": "Folder created successfully",
-        "created_folders": created_folders
+        "created_folders": [{"id": str(f.id), "drive_path": f.drive_path} for f in created]
     }
 
 @router.delete("/delete-folder")
-def delete_folder(
+async def delete_folder(
     folder_name: str = Body(..., embed=True),
     parent_path: str = Body(..., embed=True),
     user=Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Deletes a folder, its subfolders, and all files inside.
+    Moves a folder, its subfolders, and all files inside to the trash.
+    Everything gets the same deleted_at, which is how restore-folder finds
+    the rows to bring back.
     """
-    parent_path = normalize_folder_path(parent_path)
+    folder_path = normalize_folder_path(f"{parent_path.strip('/')}/{folder_name}")
 
     # Check folder exists
-    folder = db.query(models.Folder).filter(
+    folder = await db.scalar(select(models.Folder).where(
         models.Folder.owner_id == user.id,
-        models.Folder.drive_path == parent_path,
-        models.Folder.name == folder_name
-    ).first()
+        models.Folder.drive_path == folder_path,
+        models.Folder.deleted_at.is_(None)
+    ))
 
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not found")
 
-    # --- Delete all subfolders (including this one) ---
-    subfolders = db.query(models.Folder).filter(
-        models.Folder.owner_id == user.id,
-        models.Folder.drive_path.startswith(parent_path)
-    ).all()
+    deleted_at = datetime.utcnow()
+    deleted_file_ids = (await db.execute(
+        update(models.File).where(
+            models.File.owner_id == user.id,
+            models.File.drive_path.startswith(folder_path, autoescape=True),
+            models.File.deleted_at.is_(None)
+        ).values(deleted_at=deleted_at).returning(models.File.id),
+        execution_options={"synchronize_session": False},
+    )).scalars().all()
+    folders_deleted = (await db.execute(
+        update(models.Folder).where(
+            models.Folder.owner_id == user.id,
+            models.Folder.drive_path.startswith(folder_path, autoescape=True),
+            models.Folder.deleted_at.is_(None)
+        ).values(deleted_at=deleted_at),
+        execution_options={"synchronize_session": False},
+    )).rowcount
 
-    for sub in subfolders:
-        db.delete(sub)
+    await db.run_sync(touch_drive, user.id)
+    await db.commit()
+    await indexer.publish(deleted_file_ids, "delete-folder")
 
-    # --- Delete all files inside folder and subfolders ---
-    files = db.query(models.File).filter(
+    return {
+        "message": f"Folder '{folder_path}' moved to trash",
+        "files_deleted": len(deleted_file_ids),
+        "folders_deleted": folders_deleted,
+    }
+
+
+@router.get("/trash")
+async def list_trash(user=Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    """
+    List trashed items. Items trashed together with their folder are only
+    represented by that folder.
+    """
+    trashed_parent = aliased(models.Folder)
+
+    folders = (await db.execute(select(
+        models.Folder.id, models.Folder.name, models.Folder.drive_path, models.Folder.deleted_at
+    ).outerjoin(
+        trashed_parent,
+        and_(trashed_parent.id == models.Folder.parent_id, trashed_parent.deleted_at == models.Folder.deleted_at),
+    ).where(
+        models.Folder.owner_id == user.id,
+        models.Folder.deleted_at.isnot(None),
+        trashed_parent.id.is_(None),
+    ).order_by(models.Folder.deleted_at.desc()))).all()
+
+    files = (await db.execute(select(
+        models.File.id, models.File.original_name, models.File.drive_path,
+        models.File.content_type, models.File.deleted_at,
+    ).outerjoin(
+        trashed_parent,
+        and_(trashed_parent.id == models.File.folder_id, trashed_parent.deleted_at == models.File.deleted_at),
+    ).where(
         models.File.owner_id == user.id,
-        models.File.drive_path.startswith(parent_path)
-    ).all()
+        models.File.deleted_at.isnot(None),
+        models.File.status == "ready",
+        trashed_parent.id.is_(None),
+    ).order_by(models.File.deleted_at.desc()))).all()
+
+    return {
+        "folders": [
+            {"id": str(f.id), "name": f.name, "drive_path": f.drive_path, "deleted_at": f.deleted_at.isoformat()}
+            for f in folders
+        ],
+        "files": [
+            {
+                "id": str(f.id),
+                "original_name": f.original_name,
+                "drive_path": f.drive_path,
+                "content_type": f.content_type,
+                "deleted_at": f.deleted_at.isoformat(),
+            }
+            for f in files
+        ],
+    }
+
+
+@router.post("/restore-file/{file_id}")
+async def restore_file(file_id: UUID, user=Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    file = await db.scalar(select(models.File).where(
+        models.File.id == file_id, models.File.owner_id == user.id, models.File.deleted_at.isnot(None)
+    ))
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found in trash")
+
+    await db.run_sync(ensure_unique_file_name, user.id, file.drive_path, file.original_name)
+    # Its folder may be in the trash (restored) or gone (recreated)
+    parent = await db.run_sync(restore_parent_folders, user.id, file.drive_path)
 
-    for f in files:
-        # Delete from local storage
-        if os.path.exists(f.physical_path):
-            os.remove(f.physical_path)
+    file.deleted_at = None
+    file.folder_id = parent.id if parent else None
+    await db.run_sync(touch_drive, user.id)
+    await db.commit()
+    await indexer.publish([file_id], "restore")
 
-        # Delete from S3
-        if f.s3_path:
-            delete_from_s3(f.s3_path)
+    return {"message": "File restored successfully", "file_id": str(file.id), "drive_path": file.drive_path}
+
+
+@router.post("/restore-folder/{folder_id}")
+async def restore_folder(folder_id: UUID, user=Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    folder = await db.scalar(select(models.Folder).where(
+        models.Folder.id == folder_id, models.Folder.owner_id == user.id, models.Folder.deleted_at.isnot(None)
+    ))
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not found in trash")
+
+    folder_path = folder.drive_path
+    deleted_at = folder.deleted_at
+    await db.run_sync(ensure_folder_path_free, user.id, folder_path)
+    parent_path = "/".join(folder_path.strip("/").split("/")[:-1])
+    parent = await db.run_sync(restore_parent_folders, user.id, parent_path)
+
+    # Bring back everything that was trashed together with this folder
+    folders_restored = (await db.execute(
+        update(models.Folder).where(
+            models.Folder.owner_id == user.id,
+            models.Folder.drive_path.startswith(folder_path, autoescape=True),
+            models.Folder.deleted_at == deleted_at
+        ).values(deleted_at=None),
+        execution_options={"synchronize_session": False},
+    )).rowcount
+    restored_file_ids = (await db.execute(
+        update(models.File).where(
+            models.File.owner_id == user.id,
+            models.File.drive_path.startswith(folder_path, autoescape=True),
+            models.File.deleted_at == deleted_at
+        ).values(deleted_at=None).returning(models.File.id),
+        execution_options={"synchronize_session": False},
+    )).scalars().all()
+    await db.execute(
+        update(models.Folder).where(models.Folder.id == folder_id).values(parent_id=parent.id if parent else None),
+        execution_options={"synchronize_session": False},
+    )
+
+    await db.run_sync(touch_drive, user.id)
+    await db.commit()
+    await indexer.publish(restored_file_ids, "restore-folder")
+
+    return {
+        "message": "Folder restored successfully",
+        "drive_path": folder_path,
+        "folders_restored": folders_restored,
+        "files_restored": len(restored_file_ids),
+    }
+
+
+@router.delete("/trash")
+async def empty_trash(background_tasks: BackgroundTasks, user=Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    """
+    Permanently delete everything in the user's trash. Stored objects are
+    purged by a background job whose progress is at /files/jobs/{job_id}.
+    """
+    orphaned, files_purged = await db.run_sync(purge_trashed, user.id)
+    job = await db.run_sync(create_job, "empty-trash", user.id, len(orphaned))
+    job_id = job.id
+    await db.commit()
+    background_tasks.add_task(run_delete_job, job_id, orphaned)
+
+    return {"message": "Trash emptied", "files_deleted": files_purged, "job_id": str(job_id)}
+
+
+@router.get("/download-url/{file_id}")
+async def get_download_url(file_id: UUID, user=Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    """Short-lived presigned GET so the client downloads straight from S3."""
+    file = await db.scalar(select(models.File).where(
+        models.File.id == file_id,
+        models.File.owner_id == user.id,
+        models.File.deleted_at.is_(None),
+        models.File.status == "ready",
+    ))
+    if not file or not file.s3_path:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    return {
+        "url": presign_get(file.s3_path, file.original_name),
+        "expires_in": PRESIGNED_URL_EXPIRY,
+    }
 
-        db.delete(f)
 
-    db.commit()
-    return {"message": f"Folder '{parent_path}' and its contents deleted successfully"}
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: UUID, user=Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    job = await db.scalar(select(models.Job).where(models.Job.id == job_id, models.Job.owner_id == user.id))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_status(job)
@@ -0,0 +1,304 @@
+import os, uuid, asyncio, zipfile, threading
+from datetime import datetime
+from fastapi import Depends, APIRouter, HTTPException, Request, BackgroundTasks
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from botocore.exceptions import ClientError
+from app import models
+from app.database import get_db, get_async_db
+from app.auth import get_current_user
+from app.routes.cdn import local_cache, normalize_folder_path
+from app.utils.s3 import get_object, download_from_s3, content_disposition
+from uuid import UUID
+
+router = APIRouter()
+
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", 1024 * 1024))
+
+# Folder archives read this many files ahead, buffering at most this many
+# chunks per file, so memory stays at about FILES * CHUNKS * DOWNLOAD_CHUNK_SIZE
+ZIP_PREFETCH_FILES = int(os.getenv("ZIP_PREFETCH_FILES", 4))
+ZIP_PREFETCH_CHUNKS = int(os.getenv("ZIP_PREFETCH_CHUNKS", 4))
+
+# Cache fills currently running in this process, so a key is fetched once.
+# fill_cache runs in threadpool threads, hence the lock.
+_filling = set()
+_filling_lock = threading.Lock()
+
+
+#helper functions
+def get_ready_file(db: Session, file_id: UUID, owner_id) -> models.File:
+    file = db.query(models.File).filter(
+        models.File.id == file_id,
+        models.File.owner_id == owner_id,
+        models.File.deleted_at.is_(None),
+        models.File.status == "ready",
+    ).first()
+    if not file or not file.s3_path:
+        raise HTTPException(status_code=404, detail="File not found")
+    return file
+
+def file_etag(file: models.File) -> str:
+    """A file's content never changes after upload, so its blob hash (or id) is a strong ETag."""
+    return f'"{file.blob.sha256 if file.blob_id else file.id}"'
+
+def ready_file_and_etag(db: Session, file_id: UUID, owner_id) -> tuple[models.File, str]:
+    file = get_ready_file(db, file_id, owner_id)
+    return file, file_etag(file)
+
+def wanted_range(request: Request, etag: str) -> str | None:
+    """The Range header, unless an If-Range validator says the client's copy is stale."""
+    byte_range = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if byte_range and if_range and if_range.strip() != etag:
+        return None
+    return byte_range
+
+def fill_cache(s3_key: str, local_path: str):
+    """Background task: copy an object into the local store."""
+    with _filling_lock:
+        if local_path in _filling:
+            return
+        _filling.add(local_path)
+    tmp_path = f"{local_path}.{uuid.uuid4().hex}.part"
+    try:
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        download_from_s3(s3_key, tmp_path)
+        os.replace(tmp_path, local_path)
+        local_cache.add(local_path)
+    except Exception as e:
+        print(f"Cache fill failed for {s3_key}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    finally:
+        with _filling_lock:
+            _filling.discard(local_path)
+
+
+async def iter_s3_body(body, cache_path: str | None):
+    """
+    Relay an S3 body to the client. With cache_path, the same chunks are
+    written to a temp file that replaces cache_path once the body is complete.
+    """
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex}.part" if cache_path else None
+    tmp = None
+    try:
+        if tmp_path:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp = open(tmp_path, "wb")
+        while True:
+            chunk = await run_in_threadpool(body.read, DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if tmp:
+                tmp.write(chunk)
+            yield chunk
+        if tmp:
+            tmp.close()
+            os.replace(tmp_path, cache_path)
+            await run_in_threadpool(local_cache.add, cache_path)
+    finally:
+        body.close()
+        if tmp and not tmp.closed:
+            # Client went away mid-download; don't keep a partial file
+            tmp.close()
+            os.remove(tmp_path)
+
+
+@router.get("/{file_id}/content")
+async def download_file(
+    file_id: UUID,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Stream a file's content with Range / If-Range / If-None-Match support.
+    Served from the local store when cached, ranged or not (FileResponse can
+    use zero-copy sendfile where the server supports it); otherwise streamed
+    from S3 while the local copy is filled in.
+    """
+    file, etag = await db.run_sync(ready_file_and_etag, file_id, user.id)
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=0, must-revalidate",
+    }
+
+    if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    media_type = file.content_type or "application/octet-stream"
+
+    # ---- Cache hit: serve from disk (FileResponse handles Range and If-Range) ----
+    st = local_cache.get(file.physical_path)
+    if st is not None:
+        return FileResponse(
+            file.physical_path,
+            media_type=media_type,
+            headers={**headers, "Content-Disposition": content_disposition(file.original_name)},
+            stat_result=st,
+        )
+
+    # ---- Cache miss: stream from S3 ----
+    byte_range = wanted_range(request, etag)
+    if byte_range and "," in byte_range:
+        byte_range = None
+    try:
+        obj = await run_in_threadpool(get_object, file.s3_path, byte_range)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "InvalidRange":
+            raise HTTPException(status_code=416, detail="Range not satisfiable")
+        raise
+
+    headers["Content-Length"] = str(obj["ContentLength"])
+    headers["Content-Disposition"] = content_disposition(file.original_name)
+    if obj.get("ContentRange"):
+        headers["Content-Range"] = obj["ContentRange"]
+        # A partial read can't fill the cache; fetch the whole object separately
+        background_tasks.add_task(fill_cache, file.s3_path, file.physical_path)
+        return StreamingResponse(iter_s3_body(obj["Body"], None), status_code=206, media_type=media_type, headers=headers)
+
+    return StreamingResponse(iter_s3_body(obj["Body"], file.physical_path), media_type=media_type, headers=headers)
+
+
+class ZipSink:
+    """Write-only file object for zipfile; whatever it writes is drained and streamed out."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+async def read_entry(entry: dict, queue: asyncio.Queue):
+    """Producer: push an archive entry's content into queue in chunks, then None."""
+    try:
+        if local_cache.get(entry["physical_path"]) is not None:
+            with open(entry["physical_path"], "rb") as f:
+                while chunk := await run_in_threadpool(f.read, DOWNLOAD_CHUNK_SIZE):
+                    await queue.put(chunk)
+        else:
+            obj = await run_in_threadpool(get_object, entry["s3_path"])
+            body = obj["Body"]
+            try:
+                while chunk := await run_in_threadpool(body.read, DOWNLOAD_CHUNK_SIZE):
+                    await queue.put(chunk)
+            finally:
+                body.close()
+        await queue.put(None)
+    except Exception as e:
+        await queue.put(e)
+
+async def iter_zip(directories: list, entries: list):
+    """
+    Stream a ZIP64 archive. Entries are written in order while the next
+    ZIP_PREFETCH_FILES are already being read through bounded queues, so
+    neither the archive nor any whole file is held in memory.
+    """
+    sink = ZipSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+    queues = [asyncio.Queue(maxsize=ZIP_PREFETCH_CHUNKS) for _ in entries]
+    producers = {}
+
+    def prefetch(index):
+        if index < len(entries) and index not in producers:
+            producers[index] = asyncio.create_task(read_entry(entries[index], queues[index]))
+
+    try:
+        for directory in directories:
+            archive.writestr(zipfile.ZipInfo(directory), b"")
+        yield sink.drain()
+
+        for index in range(min(ZIP_PREFETCH_FILES, len(entries))):
+            prefetch(index)
+
+        for index, entry in enumerate(entries):
+            prefetch(index + ZIP_PREFETCH_FILES)
+
+            info = zipfile.ZipInfo(entry["arcname"], entry["date_time"])
+            info.compress_type = zipfile.ZIP_STORED
+            with archive.open(info, "w", force_zip64=True) as dest:
+                while (chunk := await queues[index].get()) is not None:
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+
+            queues[index] = None
+            producers.pop(index, None)
+
+        archive.close()
+        yield sink.drain()
+    finally:
+        for task in producers.values():
+            task.cancel()
+
+
+@router.get("/folder-archive")
+def download_folder_archive(path: str, user=Depends(get_current_user), db: Session = Depends(get_db)):
+    """Download a folder (and everything below it) as a ZIP streamed on the fly."""
+    folder_path = normalize_folder_path(path)
+    root_name = folder_path.strip("/").split("/")[-1] or "drive"
+
+    if folder_path != "/":
+        folder = db.query(models.Folder.id).filter(
+            models.Folder.owner_id == user.id,
+            models.Folder.drive_path == folder_path,
+            models.Folder.deleted_at.is_(None),
+        ).first()
+        if not folder:
+            raise HTTPException(status_code=404, detail="Folder not found")
+
+    # Only metadata is loaded here; content is read while streaming
+    subfolders = db.query(models.Folder.drive_path).filter(
+        models.Folder.owner_id == user.id,
+        models.Folder.drive_path.startswith(folder_path, autoescape=True),
+        models.Folder.deleted_at.is_(None),
+    ).order_by(models.Folder.drive_path).all()
+
+    files = db.query(
+        models.File.original_name, models.File.drive_path, models.File.s3_path,
+        models.File.physical_path, models.File.created_at,
+    ).filter(
+        models.File.owner_id == user.id,
+        models.File.drive_path.startswith(folder_path, autoescape=True),
+        models.File.deleted_at.is_(None),
+        models.File.status == "ready",
+        models.File.s3_path.isnot(None),
+    ).order_by(models.File.drive_path, models.File.original_name).all()
+
+    def arcname(drive_path: str, name: str = "") -> str:
+        return f"{root_name}/{drive_path[len(folder_path):]}{name}"
+
+    directories = [arcname(f.drive_path) for f in subfolders]
+    entries = [
+        {
+            "arcname": arcname(f.drive_path, f.original_name),
+            "s3_path": f.s3_path,
+            "physical_path": f.physical_path,
+            # ZIP timestamps can't go before 1980
+            "date_time": max(f.created_at or datetime.utcnow(), datetime(1980, 1, 1)).timetuple()[:6],
+        }
+        for f in files
+    ]
+
+    return StreamingResponse(
+        iter_zip(directories, entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(f"{root_name}.zip", "attachment")},
+    )
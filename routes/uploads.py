@@ -0,0 +1,381 @@
+import os, hashlib
+from fastapi import Depends, APIRouter, HTTPException, Body, Request, BackgroundTasks
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from app import models
+from app.database import get_db, get_async_db
+from app.auth import get_current_user
+from app.routes.cdn import (
+    STORE_DIR,
+    BLOB_PREFIX,
+    new_stored_object,
+    normalize_folder_path,
+    normalize_file_path,
+    ensure_parent_folders,
+    ensure_unique_file_name,
+    touch_drive,
+    find_blob,
+    attach_blob,
+)
+from app.utils.derivatives import generate_derivatives
+from app.utils import indexer
+from app.utils.s3 import (
+    S3_MIN_PART_SIZE,
+    S3_PART_SIZE,
+    PRESIGNED_URL_EXPIRY,
+    MultipartUpload,
+    delete_from_s3,
+    get_s3_url,
+    head_object,
+    presign_post,
+    presign_put,
+)
+from uuid import UUID
+
+router = APIRouter()
+
+# S3 allows at most 10,000 parts per upload
+S3_MAX_PARTS = 10000
+MAX_PART_SIZE = int(os.getenv("MAX_UPLOAD_PART_SIZE", 64 * 1024 * 1024))
+# A single PUT/POST to S3 is limited to 5 GB; larger files use the resumable API
+MAX_DIRECT_UPLOAD_SIZE = int(os.getenv("MAX_DIRECT_UPLOAD_SIZE", 5 * 1024 ** 3))
+
+
+#helper functions
+def get_session(db: Session, upload_id: UUID, owner_id) -> models.UploadSession:
+    session = db.query(models.UploadSession).filter(
+        models.UploadSession.id == upload_id,
+        models.UploadSession.owner_id == owner_id,
+    ).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+def sorted_parts(db: Session, session: models.UploadSession) -> list:
+    return sorted(session.parts, key=lambda p: p.part_number)
+
+def record_part(db: Session, session_id, part_number: int, etag: str, size: int, sha256: str):
+    """Add or replace one part of an upload session (saved with the caller's commit)."""
+    part = db.query(models.UploadPart).filter(
+        models.UploadPart.session_id == session_id,
+        models.UploadPart.part_number == part_number,
+    ).first()
+    if part:
+        part.etag = etag
+        part.size = size
+        part.sha256 = sha256
+    else:
+        db.add(models.UploadPart(session_id=session_id, part_number=part_number, etag=etag, size=size, sha256=sha256))
+    db.query(models.UploadSession).filter(models.UploadSession.id == session_id).update(
+        {models.UploadSession.updated_at: func.now()}, synchronize_session=False
+    )
+
+def session_status(session: models.UploadSession) -> dict:
+    parts = sorted(session.parts, key=lambda p: p.part_number)
+    status = {
+        "upload_id": str(session.id),
+        "original_name": session.original_name,
+        "drive_path": session.drive_path,
+        "part_size": session.part_size,
+        "total_size": session.total_size,
+        "received_bytes": sum(p.size for p in parts),
+        "parts": [{"part_number": p.part_number, "size": p.size} for p in parts],
+    }
+    if session.total_size is not None:
+        expected = max(1, -(-session.total_size // session.part_size))
+        received = {p.part_number for p in parts}
+        status["missing_parts"] = [n for n in range(1, expected + 1) if n not in received]
+    return status
+
+def composite_sha256(parts) -> str:
+    """
+    Content id for a file uploaded in parts, built from the per-part digests
+    like S3 builds multipart ETags. It only matches other uploads of the same
+    content with the same part size.
+    """
+    digest = hashlib.sha256()
+    for p in parts:
+        digest.update(bytes.fromhex(p.sha256))
+    return f"{digest.hexdigest()}-{len(parts)}"
+
+
+@router.post("/init")
+def init_upload(
+    file_name: str = Body(..., embed=True),
+    drive_path: str = Body("", embed=True),
+    content_type: str = Body("application/octet-stream", embed=True),
+    total_size: int | None = Body(None, embed=True),
+    part_size: int | None = Body(None, embed=True),
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Start a resumable upload. The client then PUTs the file in parts of
+    `part_size` bytes (the last one may be shorter) and calls /complete.
+    """
+    drive_path = drive_path.strip("/")
+    part_size = part_size or S3_PART_SIZE
+    if part_size < S3_MIN_PART_SIZE or part_size > MAX_PART_SIZE:
+        raise HTTPException(status_code=400, detail=f"part_size must be between {S3_MIN_PART_SIZE} and {MAX_PART_SIZE} bytes")
+    if total_size is not None and -(-total_size // part_size) > S3_MAX_PARTS:
+        raise HTTPException(status_code=400, detail="File too large for the given part_size")
+
+    # Fail early instead of after the whole file has been sent
+    ensure_unique_file_name(db, user.id, drive_path, file_name)
+
+    unique_filename, _, s3_key = new_stored_object(os.path.splitext(file_name)[1])
+
+    upload = MultipartUpload(s3_key, content_type)
+    upload.start()
+
+    session = models.UploadSession(
+        original_name=file_name,
+        stored_name=unique_filename,
+        drive_path=normalize_file_path(drive_path),
+        content_type=content_type,
+        s3_path=s3_key,
+        s3_upload_id=upload.upload_id,
+        part_size=part_size,
+        total_size=total_size,
+        owner_id=user.id,
+    )
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+
+    return session_status(session)
+
+
+@router.put("/{upload_id}")
+async def upload_part(
+    upload_id: UUID,
+    request: Request,
+    part_number: int | None = None,
+    offset: int | None = None,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Upload one part of the file as the raw request body.
+    Identify it either by `part_number` (1-based) or by byte `offset`,
+    which must be a multiple of the session's part_size.
+    Re-sending a part replaces the previous copy.
+    """
+    session = await db.run_sync(get_session, upload_id, user.id)
+
+    if part_number is None:
+        if offset is None:
+            raise HTTPException(status_code=400, detail="part_number or offset is required")
+        if offset % session.part_size:
+            raise HTTPException(status_code=400, detail="offset must be a multiple of part_size")
+        part_number = offset // session.part_size + 1
+    if part_number < 1 or part_number > S3_MAX_PARTS:
+        raise HTTPException(status_code=400, detail="Invalid part number")
+
+    # Parts are at most part_size bytes, so this buffer is bounded
+    data = bytearray()
+    async for chunk in request.stream():
+        data += chunk
+        if len(data) > session.part_size:
+            raise HTTPException(status_code=413, detail="Part larger than part_size")
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty part")
+
+    upload = MultipartUpload(session.s3_path, session.content_type, upload_id=session.s3_upload_id)
+    etag = await run_in_threadpool(upload.upload_part, bytes(data), part_number)
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    await db.run_sync(record_part, session.id, part_number, etag, len(data), sha256)
+    await db.commit()
+
+    return {"part_number": part_number, "size": len(data), "etag": etag}
+
+
+@router.get("/{upload_id}")
+def upload_status(upload_id: UUID, user=Depends(get_current_user), db: Session = Depends(get_db)):
+    """Report which parts have been received so a client can resume."""
+    return session_status(get_session(db, upload_id, user.id))
+
+
+@router.post("/{upload_id}/complete")
+async def complete_upload(upload_id: UUID, background_tasks: BackgroundTasks, user=Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    session = await db.run_sync(get_session, upload_id, user.id)
+    parts = await db.run_sync(sorted_parts, session)
+
+    # ---- Validate that the parts form one contiguous file ----
+    if not parts:
+        raise HTTPException(status_code=400, detail="No parts uploaded")
+    if [p.part_number for p in parts] != list(range(1, len(parts) + 1)):
+        raise HTTPException(status_code=400, detail="Missing parts")
+    if any(p.size != session.part_size for p in parts[:-1]):
+        raise HTTPException(status_code=400, detail="Only the last part may be smaller than part_size")
+    total_size = sum(p.size for p in parts)
+    if session.total_size is not None and total_size != session.total_size:
+        raise HTTPException(status_code=400, detail="Uploaded size does not match total_size")
+
+    # Same folder / duplicate handling as /files/fileSave
+    parent_folder = await db.run_sync(ensure_parent_folders, user.id, session.drive_path)
+    await db.run_sync(ensure_unique_file_name, user.id, session.drive_path, session.original_name)
+
+    # Known content: drop the uploaded parts and point at the existing blob
+    sha256 = composite_sha256(parts)
+    upload = MultipartUpload(session.s3_path, session.content_type, upload_id=session.s3_upload_id)
+    if await db.run_sync(find_blob, sha256):
+        s3_url = None
+        await run_in_threadpool(upload.abort)
+    else:
+        s3_url = await run_in_threadpool(upload.complete, [{"PartNumber": p.part_number, "ETag": p.etag} for p in parts])
+
+    new_file = models.File(
+        original_name=session.original_name,
+        stored_name=session.stored_name,
+        physical_path=os.path.join(STORE_DIR, BLOB_PREFIX, session.stored_name),
+        drive_path=session.drive_path,
+        content_type=session.content_type,
+        s3_path=session.s3_path,
+        s3_url=s3_url,
+        size=total_size,
+        folder_id=parent_folder.id if parent_folder else None,
+        owner_id=user.id,
+    )
+    await db.run_sync(attach_blob, new_file, sha256, total_size)
+    db.add(new_file)
+    await db.delete(session)
+    await db.run_sync(touch_drive, user.id)
+    await db.commit()
+    await db.refresh(new_file)
+    background_tasks.add_task(generate_derivatives, new_file.id)
+    await indexer.publish([new_file.id], "upload")
+
+    return {
+        "message": "File saved successfully",
+        "file_id": new_file.id,
+        "original_filename": new_file.original_name,
+        "drive_path": normalize_folder_path(new_file.drive_path),
+        "size": total_size,
+    }
+
+
+@router.delete("/{upload_id}")
+def abort_upload(upload_id: UUID, user=Depends(get_current_user), db: Session = Depends(get_db)):
+    session = get_session(db, upload_id, user.id)
+
+    MultipartUpload(session.s3_path, session.content_type, upload_id=session.s3_upload_id).abort()
+
+    db.delete(session)
+    db.commit()
+    return {"message": "Upload aborted"}
+
+
+@router.post("/presign")
+def presign_upload(
+    file_name: str = Body(..., embed=True),
+    size: int = Body(..., embed=True),
+    drive_path: str = Body("", embed=True),
+    content_type: str = Body("application/octet-stream", embed=True),
+    sha256: str | None = Body(None, embed=True),
+    method: str = Body("put", embed=True),
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Start a direct-to-S3 upload. Creates a pending File row and returns a
+    presigned PUT URL (method="put") or POST policy (method="post"). The
+    client uploads the bytes to S3 itself and then calls
+    /presign/{file_id}/confirm.
+
+    Passing the content's sha256 (hex) makes S3 verify it and lets the
+    file be deduplicated against stored blobs on confirm.
+    """
+    drive_path = drive_path.strip("/")
+    method = method.lower()
+    if method not in ("put", "post"):
+        raise HTTPException(status_code=400, detail="method must be 'put' or 'post'")
+    if size < 0 or size > MAX_DIRECT_UPLOAD_SIZE:
+        raise HTTPException(status_code=400, detail="File too large for a direct upload, use the resumable upload API")
+    if sha256 is not None:
+        try:
+            if len(bytes.fromhex(sha256)) != 32:
+                raise ValueError(sha256)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="sha256 must be 64 hex characters")
+
+    # The pending row reserves the name until the upload is confirmed or expires
+    ensure_unique_file_name(db, user.id, drive_path, file_name)
+
+    unique_filename, local_path, s3_key = new_stored_object(os.path.splitext(file_name)[1])
+
+    pending = models.File(
+        original_name=file_name,
+        stored_name=unique_filename,
+        physical_path=local_path,
+        drive_path=normalize_file_path(drive_path),
+        content_type=content_type,
+        s3_path=s3_key,
+        size=size,
+        status="pending",
+        owner_id=user.id,
+    )
+    db.add(pending)
+    db.commit()
+    db.refresh(pending)
+
+    if method == "put":
+        presigned = presign_put(s3_key, content_type, sha256)
+        upload = {"method": "PUT", "url": presigned["url"], "headers": presigned["headers"]}
+    else:
+        presigned = presign_post(s3_key, content_type, size)
+        upload = {"method": "POST", "url": presigned["url"], "fields": presigned["fields"]}
+
+    return {"file_id": str(pending.id), "expires_in": PRESIGNED_URL_EXPIRY, **upload}
+
+
+@router.post("/presign/{file_id}/confirm")
+async def confirm_presigned_upload(file_id: UUID, background_tasks: BackgroundTasks, user=Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    """Check that the object reached S3 and make the pending file visible."""
+    file = await db.scalar(select(models.File).where(
+        models.File.id == file_id,
+        models.File.owner_id == user.id,
+        models.File.status == "pending",
+        models.File.deleted_at.is_(None),
+    ))
+    if not file:
+        raise HTTPException(status_code=404, detail="Pending upload not found")
+
+    info = await run_in_threadpool(head_object, file.s3_path)
+    if info is None:
+        raise HTTPException(status_code=400, detail="File has not been uploaded yet")
+    if file.size is not None and info["size"] != file.size:
+        await run_in_threadpool(delete_from_s3, file.s3_path)
+        raise HTTPException(status_code=400, detail="Uploaded size does not match the declared size")
+
+    # Same folder handling as /files/fileSave
+    parent_folder = await db.run_sync(ensure_parent_folders, user.id, file.drive_path)
+
+    uploaded_key = file.s3_path
+    file.folder_id = parent_folder.id if parent_folder else None
+    file.size = info["size"]
+    file.s3_url = get_s3_url(uploaded_key)
+    file.status = "ready"
+
+    # S3 verified the checksum, so the content can be matched against known blobs
+    if info["sha256"]:
+        await db.run_sync(attach_blob, file, info["sha256"], info["size"])
+        if file.s3_path != uploaded_key:
+            await run_in_threadpool(delete_from_s3, uploaded_key)
+
+    await db.run_sync(touch_drive, user.id)
+    await db.commit()
+    await db.refresh(file)
+    background_tasks.add_task(generate_derivatives, file.id)
+    await indexer.publish([file.id], "upload")
+
+    return {
+        "message": "File saved successfully",
+        "file_id": file.id,
+        "original_filename": file.original_name,
+        "drive_path": file.drive_path,
+        "size": file.size,
+    }
@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
 from fastapi.responses import Response
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import models, schemas, auth
-from app.database import get_db
+from app.database import get_async_db
 from app.utils.email import send_verification_email
 from jose import JWTError, jwt
 from datetime import timedelta
@@ -11,8 +12,8 @@ import os
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
 @router.post("/signup", response_model=schemas.UserOut)
-async def signup(user: schemas.UserCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    existing = db.query(models.User).filter(models.User.email == str.lower(user.email)).first()
+async def signup(user: schemas.UserCreate, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+    existing = await db.scalar(select(models.User).where(models.User.email == str.lower(user.email)))
     if existing:
         # If exists but not verified → send them another verification email
         if not existing.is_verified:
@@ -26,11 +27,11 @@ async def signup(user: schemas.UserCreate, background_tasks: BackgroundTasks, db
         # If exists and verified
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed = auth.get_password_hash(user.password)
+    hashed = await auth.hash_password(user.password)
     new_user = models.User(username=user.username, email=str.lower(user.email), hashed_password=hashed)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
 
     # Generate email verification token
     verification_token = auth.create_access_token(
@@ -43,7 +44,7 @@ async def signup(user: schemas.UserCreate, background_tasks: BackgroundTasks, db
     return new_user
 
 @router.get("/verify-email")
-def verify_email(token: str, db: Session = Depends(get_db)):
+async def verify_email(token: str, db: AsyncSession = Depends(get_async_db)):
     try:
         payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
         email = payload.get("sub")
@@ -52,7 +53,7 @@ def verify_email(token: str, db: Session = Depends(get_db)):
     except JWTError:
         raise HTTPException(status_code=400, detail="Invalid or expired token")
 
-    user = db.query(models.User).filter(models.User.email == email).first()
+    user = await db.scalar(select(models.User).where(models.User.email == email))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -60,20 +61,30 @@ def verify_email(token: str, db: Session = Depends(get_db)):
         return {"message": "Email already verified"}
 
     user.is_verified = True
-    db.commit()
+    await db.commit()
+    await auth.user_cache.invalidate(user)
     return {"message": "Email verified successfully"}
 
 
 @router.post("/login")
-def login(form: schemas.UserLogin, response: Response, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == form.email).first()
-    if not user or not auth.verify_password(form.password, user.hashed_password):
+async def login(form: schemas.UserLogin, response: Response, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(models.User).where(models.User.email == form.email))
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await auth.check_password(form.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    # Transparently move the hash to the current work factor
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     
     if not user.is_verified:
         raise HTTPException(status_code=403, detail="Verify your email first")
 
-    token = auth.create_access_token(data={"sub": user.email})
+    # uid lets get_current_user look the user up by primary key
+    token = auth.create_access_token(data={"sub": user.email, "uid": str(user.id)})
 
     # Set cookie with JWT token
     response.set_cookie(
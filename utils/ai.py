@@ -6,7 +6,226 @@ from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.prompts import PromptTemplate
 from langchain_groq import ChatGroq
 import chromadb
-import os
+import numpy as np
+import os, time, uuid, threading, asyncio
+from collections import OrderedDict
+from starlette.concurrency import run_in_threadpool
+from app.utils.cache import TTLCache
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+CHROMA_HOST = os.getenv("CHROMA_HOST", "chroma")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", 8000))
+COLLECTION_NAME = os.getenv("CHROMA_COLLECTION", "multimodal_documents_collection")
+LLM_MODEL = os.getenv("LLM_MODEL", "mixtral-8x7b-32768")
+
+# --- Shared RAG components ---
+# Built once per process (loading the embedding model takes seconds) and
+# reused by every request. warm_up() builds them in the background at startup.
+_components = {}
+_components_lock = threading.Lock()
+readiness = {"embeddings": False, "vectorstore": False, "llm": False, "error": None}
+
+def _component(name: str, factory):
+    component = _components.get(name)
+    if component is None:
+        with _components_lock:
+            component = _components.get(name)
+            if component is None:
+                component = _components[name] = factory()
+    return component
+
+def get_embeddings() -> HuggingFaceEmbeddings:
+    return _component("embeddings", lambda: HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL))
+
+def get_chroma_client():
+    return _component("chroma_client", lambda: chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT))
+
+def get_vectorstore() -> Chroma:
+    return _component("vectorstore", lambda: Chroma(
+        client=get_chroma_client(),
+        collection_name=COLLECTION_NAME,
+        embedding_function=get_embeddings(),
+    ))
+
+def get_llm() -> ChatGroq:
+    return _component("llm", lambda: ChatGroq(model=LLM_MODEL, groq_api_key=os.getenv("OPENAI_API_KEY")))
+
+def warm_up():
+    """Load the embedding model, connect to Chroma and create the LLM client; records readiness."""
+    try:
+        get_embeddings().embed_query("warm up")
+        readiness["embeddings"] = True
+        get_chroma_client().heartbeat()
+        get_vectorstore()
+        readiness["vectorstore"] = True
+        get_llm()
+        readiness["llm"] = True
+        readiness["error"] = None
+        print("AI components ready")
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"AI warm-up failed: {e}")
+
+def is_ready() -> bool:
+    return readiness["embeddings"] and readiness["vectorstore"] and readiness["llm"]
+
+# A failed warm-up is retried after this many seconds, doubling up to the maximum
+AI_WARMUP_RETRY_SECONDS = int(os.getenv("AI_WARMUP_RETRY_SECONDS", 5))
+AI_WARMUP_MAX_RETRY_SECONDS = int(os.getenv("AI_WARMUP_MAX_RETRY_SECONDS", 300))
+
+async def warm_up_until_ready():
+    """Run warm_up (in a thread) until every component is ready, e.g. once Chroma comes up."""
+    delay = AI_WARMUP_RETRY_SECONDS
+    while True:
+        await run_in_threadpool(warm_up)
+        if is_ready():
+            return
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, AI_WARMUP_MAX_RETRY_SECONDS)
+
+# --- Caches ---
+# 1. query -> embedding (LRU), 2. normalized prompt -> answer (TTL),
+# 3. optional semantic cache: an answer is reused for a query whose embedding
+#    is within AI_SEMANTIC_CACHE_THRESHOLD cosine similarity of a cached one
+#    (0 disables it).
+# All are cleared when documents are ingested. The ingesting process stamps
+# the collection metadata; API processes notice within AI_CACHE_VERSION_CHECK_SECONDS.
+AI_EMBEDDING_CACHE_SIZE = int(os.getenv("AI_EMBEDDING_CACHE_SIZE", 2048))
+AI_ANSWER_CACHE_SIZE = int(os.getenv("AI_ANSWER_CACHE_SIZE", 1024))
+AI_ANSWER_CACHE_TTL = int(os.getenv("AI_ANSWER_CACHE_TTL_SECONDS", 3600))
+AI_SEMANTIC_CACHE_THRESHOLD = float(os.getenv("AI_SEMANTIC_CACHE_THRESHOLD", 0))
+AI_SEMANTIC_CACHE_SIZE = int(os.getenv("AI_SEMANTIC_CACHE_SIZE", 1000))
+AI_CACHE_VERSION_CHECK_SECONDS = int(os.getenv("AI_CACHE_VERSION_CHECK_SECONDS", 10))
+INGEST_VERSION_KEY = "ingest_version"
+
+# Chunks of the documents/ corpus (utils/preprocess.py) are tagged with this
+# corpus and visible to everyone; chunks of drive files (utils/indexer.py)
+# carry their owner_id and are only retrieved for that user.
+SHARED_CORPUS = "shared"
+
+def search_filter(owner_id) -> dict:
+    return {"$or": [{"owner_id": str(owner_id)}, {"corpus": SHARED_CORPUS}]}
+
+
+class SemanticCache:
+    """
+    Answers keyed by query embedding. get() returns the answer of the most
+    similar cached query at or above threshold, asked with the same
+    conversation history. Entries expire after ttl; LRU beyond max_items.
+    """
+
+    def __init__(self, max_items: int, threshold: float, ttl: float):
+        self.max_items = max_items
+        self.threshold = threshold
+        self.ttl = ttl
+        self.entries = OrderedDict()  # id -> (unit vector, context, answer, expires_at)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def get(self, embedding, context: str):
+        if not self.enabled:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        now = time.monotonic()
+        with self.lock:
+            best, best_score = None, self.threshold
+            for key, (vector, entry_context, _, expires_at) in list(self.entries.items()):
+                if expires_at < now:
+                    del self.entries[key]
+                elif entry_context == context:
+                    score = float(vector @ query)
+                    if score >= best_score:
+                        best, best_score = key, score
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(best)
+            return self.entries[best][2]
+
+    def set(self, embedding, context: str, answer: str):
+        if not self.enabled:
+            return
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self.lock:
+            self.entries[uuid.uuid4().hex] = (vector, context, answer, time.monotonic() + self.ttl)
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+embedding_cache = TTLCache(AI_EMBEDDING_CACHE_SIZE, ttl=None)
+answer_cache = TTLCache(AI_ANSWER_CACHE_SIZE, ttl=AI_ANSWER_CACHE_TTL)
+semantic_cache = SemanticCache(AI_SEMANTIC_CACHE_SIZE, AI_SEMANTIC_CACHE_THRESHOLD, AI_ANSWER_CACHE_TTL)
+_ingest_state = {"version": None, "checked_at": 0.0}
+
+def invalidate_caches():
+    embedding_cache.clear()
+    answer_cache.clear()
+    semantic_cache.clear()
+
+def check_ingest_version():
+    """Clear the caches if documents were ingested since the last check (rate limited)."""
+    now = time.monotonic()
+    if now - _ingest_state["checked_at"] < AI_CACHE_VERSION_CHECK_SECONDS:
+        return
+    _ingest_state["checked_at"] = now
+    try:
+        metadata = get_chroma_client().get_collection(COLLECTION_NAME).metadata or {}
+    except Exception as e:
+        print(f"Could not read ingest version: {e}")
+        return
+    version = metadata.get(INGEST_VERSION_KEY)
+    if version != _ingest_state["version"]:
+        invalidate_caches()
+        _ingest_state["version"] = version
+
+def mark_documents_ingested(chroma_client, collection_name: str = COLLECTION_NAME):
+    """Called by ingestion after adding or removing chunks, so every API process drops its caches."""
+    collection = chroma_client.get_collection(collection_name)
+    collection.modify(metadata={**(collection.metadata or {}), INGEST_VERSION_KEY: uuid.uuid4().hex})
+    invalidate_caches()
+
+def cache_metrics() -> dict:
+    return {
+        "embedding": embedding_cache.stats(),
+        "answer": answer_cache.stats(),
+        "semantic": semantic_cache.stats(),
+    }
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+def history_key(history: list) -> str:
+    return "\n".join(f"{turn.get('role', 'user')}:{normalize_text(turn.get('text', ''))}" for turn in history)
+
+def embed_query(query: str) -> list:
+    key = normalize_text(query)
+    embedding = embedding_cache.get(key)
+    if embedding is None:
+        embedding = get_embeddings().embed_query(key)
+        embedding_cache.set(key, embedding)
+    return embedding
 
 def get_s3_file_data(s3_url: str) -> bytes:
     parsed_url = urlparse(s3_url)
@@ -17,22 +236,7 @@ def get_s3_file_data(s3_url: str) -> bytes:
     response = s3.get_object(Bucket=bucket, Key=key)
     return response["Body"].read()
 
-# --- Step 1: Vector DB search function ---
-def vector_db_search(query: str, top_k: int = 3):
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-
-    chroma_client = chromadb.HttpClient(host="chroma", port=8000)
-
-    db = Chroma(
-        client=chroma_client,
-        collection_name="multimodal_documents_collection",
-        embedding_function=embeddings
-    )
-
-    docs = db.similarity_search(query, k=top_k)
-    return docs
-
-# --- Step 2: Prompt builder function (with history) ---
+# --- Prompt builder function (with history) ---
 def build_prompt(query: str, docs, history: list):
     context = "\n\n".join([doc.page_content for doc in docs])
 
@@ -64,26 +268,79 @@ def build_prompt(query: str, docs, history: list):
     )
     return prompt.format(history=formatted_history, question=query, context=context)
 
-# --- Step 3: LLM generate function ---
-def llm_generate(prompt: str):
-    llm = ChatGroq(
-        model="mixtral-8x7b-32768",
-        groq_api_key=os.getenv("OPENAI_API_KEY")
-    )
-    response = llm.invoke(prompt)
-    return response.content
-
 # --- Final pipeline ---
-def rag_pipeline(user_query: str, history: list):
-    docs = vector_db_search(user_query)
+def answer_key(owner_id, prompt: str) -> str:
+    return f"{owner_id}\n{normalize_text(prompt)}"
+
+def retrieve(user_query: str, history: list, owner_id, top_k: int = 3) -> dict:
+    """
+    Everything before the LLM call, through the cache layers. "answer" is
+    set on a cache hit; otherwise the result carries the prompt to send and
+    what remember_answer needs. Only the shared corpus and owner_id's own
+    files are searched, and cached answers are kept per owner.
+    """
+    check_ingest_version()
+    embedding = embed_query(user_query)
+    context = f"{owner_id}\n{history_key(history)}"
+
+    answer = semantic_cache.get(embedding, context)
+    if answer is not None:
+        return {"answer": answer}
+
+    docs = get_vectorstore().similarity_search_by_vector(embedding, k=top_k, filter=search_filter(owner_id))
     prompt = build_prompt(user_query, docs, history)
-    answer = llm_generate(prompt)
-    return {"answer": answer}
+    key = answer_key(owner_id, prompt)
+    retrieved = {"answer": answer_cache.get(key), "prompt": prompt, "key": key, "embedding": embedding, "context": context}
+    if retrieved["answer"] is not None:
+        semantic_cache.set(embedding, context, retrieved["answer"])
+    return retrieved
+
+def remember_answer(retrieved: dict, answer: str):
+    answer_cache.set(retrieved["key"], answer)
+    semantic_cache.set(retrieved["embedding"], retrieved["context"], answer)
+
+
+# --- Async pipeline used by the API ---
+# The embedding model and the Chroma client are synchronous, so the search
+# runs in the threadpool; the LLM call uses ChatGroq's native async API.
+async def allm_generate(prompt: str):
+    response = await get_llm().ainvoke(prompt)
+    return response.content
+
+async def allm_stream(prompt: str):
+    """Yield the answer's text as the LLM produces it."""
+    async for chunk in get_llm().astream(prompt):
+        if chunk.content:
+            yield chunk.content
 
-# --- Main function called from routes ---
-def generate_ai_response(query: str, history: list) -> str:
+async def arag_pipeline(user_query: str, history: list, owner_id):
+    retrieved = await run_in_threadpool(retrieve, user_query, history, owner_id)
+    if retrieved["answer"] is None:
+        retrieved["answer"] = await allm_generate(retrieved["prompt"])
+        remember_answer(retrieved, retrieved["answer"])
+    return {"answer": retrieved["answer"]}
+
+async def agenerate_ai_response(query: str, history: list, owner_id) -> str:
     if not query or query.strip() == "":
         return "Please provide a valid query."
 
-    result = rag_pipeline(query, history)
+    result = await arag_pipeline(query, history, owner_id)
     return result["answer"]
+
+async def stream_ai_response(query: str, history: list, owner_id):
+    """Like agenerate_ai_response, but yields the answer in pieces."""
+    if not query or query.strip() == "":
+        yield "Please provide a valid query."
+        return
+
+    retrieved = await run_in_threadpool(retrieve, query, history, owner_id)
+    if retrieved["answer"] is not None:
+        yield retrieved["answer"]
+        return
+
+    tokens = []
+    async for token in allm_stream(retrieved["prompt"]):
+        tokens.append(token)
+        yield token
+    # Only complete answers are cached
+    remember_answer(retrieved, "".join(tokens))
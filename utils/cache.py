@@ -0,0 +1,187 @@
+import os, time, json, threading
+from collections import OrderedDict
+
+
+class LocalFileCache:
+    """
+    Size-bounded LRU index over the files kept in the local store.
+
+    Files themselves live at their File.physical_path; this only tracks their
+    sizes and last use so the store stays under max_bytes, evicting the least
+    recently used files first. The index is built from the directory (oldest
+    mtime first) by load(), which main.py runs in a thread at startup; until
+    then files are tracked as they are used but nothing is evicted. It is
+    kept per process, so with several workers the budget is enforced
+    approximately. max_bytes <= 0 disables eviction.
+
+    add() and load() touch the disk (stat, evictions); call them from a thread.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # path -> size, least recently used first
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    def load(self):
+        """Index the files already in the store. The walk runs without holding the lock."""
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".part"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, path, st.st_size))
+
+        with self.lock:
+            # Files used since startup stay the most recently used
+            entries = OrderedDict((path, size) for _, path, size in sorted(found) if path not in self.entries)
+            entries.update(self.entries)
+            self.entries = entries
+            self.total_bytes = sum(entries.values())
+            self.loaded = True
+            victims = self._evict(keep=None)
+        self._remove(victims)
+
+    def get(self, path: str | None):
+        """Return os.stat_result for a cached file and mark it recently used, or None."""
+        if not path:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.discard(path)
+            return None
+
+        with self.lock:
+            if path in self.entries:
+                self.entries.move_to_end(path)
+            else:
+                self.entries[path] = st.st_size
+                self.total_bytes += st.st_size
+        return st
+
+    def add(self, path: str):
+        """Register a file that was just written, then evict down to the budget."""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+
+        with self.lock:
+            self.total_bytes -= self.entries.pop(path, 0)
+            self.entries[path] = size
+            self.total_bytes += size
+            victims = self._evict(keep=path)
+        self._remove(victims)
+
+    def discard(self, path: str):
+        with self.lock:
+            self.total_bytes -= self.entries.pop(path, 0)
+
+    def _evict(self, keep: str | None) -> list:
+        """Drop least recently used entries down to the budget (lock held); returns their paths."""
+        victims = []
+        if self.max_bytes <= 0 or not self.loaded:
+            return victims
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            path, size = next(iter(self.entries.items()))
+            if path == keep:
+                self.entries.move_to_end(path)
+                continue
+            self.entries.pop(path)
+            self.total_bytes -= size
+            victims.append(path)
+        return victims
+
+    @staticmethod
+    def _remove(paths: list):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class TTLCache:
+    """
+    Size-bounded in-process cache whose entries expire ttl seconds after
+    being set (never with ttl=None, making it a plain LRU). When full, the
+    least recently used entry is dropped. Hits and misses are counted.
+    """
+
+    def __init__(self, max_items: int, ttl: float | None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class RedisCache:
+    """
+    Shared cache of JSON values in Redis, for state several processes or
+    instances should agree on. Needs the redis package (only imported when
+    one is configured).
+    """
+
+    def __init__(self, url: str, ttl: float, prefix: str):
+        import redis.asyncio as redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key):
+        raw = await self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key, value):
+        await self.client.set(self.prefix + key, json.dumps(value), ex=max(int(self.ttl), 1))
+
+    async def delete(self, *keys):
+        await self.client.delete(*(self.prefix + key for key in keys))
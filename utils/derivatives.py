@@ -0,0 +1,176 @@
+import os, io, asyncio, subprocess, tempfile
+from PIL import Image, ImageOps
+import pillow_heif
+from starlette.concurrency import run_in_threadpool
+from app import models
+from app.database import SessionLocal
+from app.utils.s3 import get_object, put_bytes_to_s3, get_s3_url
+from app.utils.images import image_pool, ImagePoolBusy
+
+# name -> longest edge in pixels, e.g. "small:128,medium:512,large:1024"
+THUMBNAIL_SIZES = {
+    name: int(edge)
+    for name, edge in (
+        item.split(":") for item in os.getenv("THUMBNAIL_SIZES", "small:128,medium:512,large:1024").split(",")
+    )
+}
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 80))
+# Derivatives of s3_path live at <prefix>/<s3_path>/<name>.webp
+DERIVATIVE_PREFIX = os.getenv("DERIVATIVE_PREFIX", "derivatives")
+# Larger sources are skipped rather than pulled into memory
+DERIVATIVE_MAX_SOURCE_BYTES = int(os.getenv("DERIVATIVE_MAX_SOURCE_BYTES", 100 * 1024 * 1024))
+# While the image pool is saturated, rendering is retried once a second this many times
+DERIVATIVE_BUSY_RETRIES = int(os.getenv("DERIVATIVE_BUSY_RETRIES", 60))
+
+
+def has_derivatives(content_type: str | None) -> bool:
+    return bool(content_type) and (content_type.startswith("image/") or content_type == "application/pdf")
+
+def derivative_key(s3_path: str, name: str) -> str:
+    return f"{DERIVATIVE_PREFIX}/{s3_path}/{name}.webp"
+
+def derivative_keys(thumbnails: dict | None) -> list:
+    return list((thumbnails or {}).values())
+
+def thumbnail_urls(thumbnails: dict | None) -> dict:
+    """File.thumbnails as exposed in listings: name -> URL."""
+    return {name: get_s3_url(key) for name, key in (thumbnails or {}).items()}
+
+
+def render_pdf_page(data: bytes, edge: int) -> Image.Image:
+    """First page of a PDF via poppler's pdftoppm, scaled to fit edge."""
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.pdf")
+        with open(source, "wb") as f:
+            f.write(data)
+        subprocess.run(
+            ["pdftoppm", "-f", "1", "-l", "1", "-singlefile", "-png", "-scale-to", str(edge), source, os.path.join(tmp, "page")],
+            check=True, capture_output=True, timeout=60,
+        )
+        with Image.open(os.path.join(tmp, "page.png")) as page:
+            page.load()
+            return page
+
+def render_derivatives(data: bytes, content_type: str, sizes: dict, quality: int) -> dict:
+    """Make one WebP per size from an image or a PDF's first page. Runs inside a pool process."""
+    if content_type == "application/pdf":
+        image = render_pdf_page(data, max(sizes.values()))
+    else:
+        pillow_heif.register_heif_opener()
+        image = Image.open(io.BytesIO(data))
+        # Decode at a reduced scale where the format supports it (JPEG)
+        image.draft("RGB", (max(sizes.values()),) * 2)
+        image = ImageOps.exif_transpose(image)
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    rendered = {}
+    for name, edge in sorted(sizes.items(), key=lambda item: -item[1]):
+        image.thumbnail((edge, edge))
+        buffer = io.BytesIO()
+        image.save(buffer, "WEBP", quality=quality)
+        rendered[name] = buffer.getvalue()
+    return rendered
+
+
+def read_source(source: dict) -> bytes | None:
+    if source["size"] and source["size"] > DERIVATIVE_MAX_SOURCE_BYTES:
+        return None
+    if source["physical_path"] and os.path.exists(source["physical_path"]):
+        with open(source["physical_path"], "rb") as f:
+            return f.read()
+    body = get_object(source["s3_path"])["Body"]
+    try:
+        return body.read()
+    finally:
+        body.close()
+
+def load_source(file_id) -> dict | None:
+    """
+    What rendering needs from the File row, or None if there is nothing to
+    do. "thumbnails" is set when another file with the same stored object
+    already has derivatives.
+    """
+    db = SessionLocal()
+    try:
+        file = db.query(models.File).filter(models.File.id == file_id).first()
+        if not file or file.thumbnails is not None or not file.s3_path or not has_derivatives(file.content_type):
+            return None
+        existing = db.query(models.File.thumbnails).filter(
+            models.File.s3_path == file.s3_path,
+            models.File.thumbnails.isnot(None),
+        ).first()
+        return {
+            "s3_path": file.s3_path,
+            "physical_path": file.physical_path,
+            "content_type": file.content_type,
+            "size": file.size,
+            "owner_id": file.owner_id,
+            "thumbnails": existing.thumbnails if existing else None,
+        }
+    finally:
+        db.close()
+
+def save_thumbnails(file_id, owner_id, thumbnails: dict):
+    db = SessionLocal()
+    try:
+        db.query(models.File).filter(models.File.id == file_id, models.File.thumbnails.is_(None)).update(
+            {models.File.thumbnails: thumbnails}, synchronize_session=False
+        )
+        db.query(models.User).filter(models.User.id == owner_id).update(
+            {models.User.drive_version: models.User.drive_version + 1}, synchronize_session=False
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def render_source(source: dict, data: bytes) -> dict | None:
+    for _ in range(DERIVATIVE_BUSY_RETRIES + 1):
+        try:
+            return await image_pool.submit(
+                render_derivatives, data, source["content_type"], THUMBNAIL_SIZES, THUMBNAIL_QUALITY
+            )
+        except ImagePoolBusy:
+            # Uploads waiting on the pool come first
+            await asyncio.sleep(1)
+        except Exception as e:
+            print(f"Could not render derivatives for {source['s3_path']}: {e}")
+            return {}
+    # Left NULL rather than marked done, so it can be generated later
+    print(f"Gave up rendering derivatives for {source['s3_path']}: image pool busy")
+    return None
+
+async def generate_derivatives(file_id):
+    """
+    Background task run after an upload: render thumbnails/previews, store
+    them under DERIVATIVE_PREFIX and record their keys on File.thumbnails.
+    Files sharing a stored object (deduplicated content) share derivatives.
+    No database connection is held while rendering.
+    """
+    try:
+        source = await run_in_threadpool(load_source, file_id)
+        if source is None:
+            return
+
+        thumbnails = source["thumbnails"]
+        if thumbnails is None:
+            data = await run_in_threadpool(read_source, source)
+            if data is None:
+                return
+            rendered = await render_source(source, data)
+            if rendered is None:
+                return
+            thumbnails = {}
+            for name, image_bytes in rendered.items():
+                key = derivative_key(source["s3_path"], name)
+                await run_in_threadpool(put_bytes_to_s3, image_bytes, "image/webp", key)
+                thumbnails[name] = key
+
+        # An empty dict marks the file as done even if nothing could be made
+        await run_in_threadpool(save_thumbnails, file_id, source["owner_id"], thumbnails)
+    except Exception as e:
+        print(f"Derivative generation failed for file {file_id}: {e}")
@@ -0,0 +1,88 @@
+import os, io, asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+import pillow_heif
+
+# Image work runs in separate processes so it never blocks the event loop
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", os.cpu_count() or 2))
+# Jobs allowed in flight (running + queued) per API worker before new ones get 429
+IMAGE_MAX_PENDING = int(os.getenv("IMAGE_MAX_PENDING", IMAGE_WORKERS * 2))
+
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 85))
+
+# format -> (extension, content type)
+OUTPUT_FORMATS = {
+    "JPEG": (".jpg", "image/jpeg"),
+    "WEBP": (".webp", "image/webp"),
+    "AVIF": (".avif", "image/avif"),
+}
+
+
+class ImagePoolBusy(Exception):
+    """Raised when the image pool already has IMAGE_MAX_PENDING jobs."""
+
+
+def convert_heic(data: bytes, output_format: str = "JPEG", quality: int = IMAGE_QUALITY) -> bytes:
+    """Decode a HEIC/HEIF image and re-encode it. Runs inside a pool process."""
+    heif_file = pillow_heif.read_heif(io.BytesIO(data))
+    image = Image.frombytes(
+        heif_file.mode, heif_file.size, heif_file.data,
+        "raw", heif_file.mode, heif_file.stride,
+    )
+    if output_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, output_format, quality=quality)
+    return buffer.getvalue()
+
+
+class ImagePool:
+    """
+    Bounded ProcessPoolExecutor shared by the requests of one API worker.
+
+    The executor is created on first use. submit() refuses work once
+    max_pending jobs are running or queued instead of letting the queue grow
+    without limit; callers turn that into a 429. If a worker process dies
+    (e.g. killed for memory on a huge image) the executor is replaced and
+    the job retried once.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.executor = None
+
+    async def submit(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise ImagePoolBusy()
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            for attempt in range(2):
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers)
+                executor = self.executor
+                try:
+                    return await loop.run_in_executor(executor, fn, *args)
+                except BrokenProcessPool:
+                    # Concurrent jobs on the same executor see this too; replace it once
+                    if self.executor is executor:
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        self.executor = None
+                    if attempt:
+                        raise
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+image_pool = ImagePool(IMAGE_WORKERS, IMAGE_MAX_PENDING)
@@ -0,0 +1,334 @@
+"""
+Event-driven search indexing for drive files.
+
+Routes publish the ids of files they created, renamed, moved to the trash
+or restored; the indexer worker brings each file's chunks in Chroma in line
+with its current row:
+
+  - trashed, purged or unsupported files have their chunks removed
+  - same content as already indexed: only the chunk metadata is updated
+  - content already indexed for another file: its embeddings are copied
+    instead of re-computed
+
+Content is identified by the Blob's sha256, or for files without one
+(uploaded before deduplication, or confirmed without a checksum) by their
+S3 object and size, which never change once stored.
+  - otherwise the file is parsed, split and embedded
+
+A job is just a file id, so a file changed several times before the worker
+gets to it is indexed once. The local backend keeps the queue in this
+process (single worker, tests); the redis backend lets several API
+processes publish to one worker (`python -m app.utils.indexer`).
+"""
+import os, time, asyncio, threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from starlette.concurrency import run_in_threadpool
+from langchain_core.documents import Document
+from app import models
+from app.database import SessionLocal
+from app.utils.s3 import get_object
+from app.utils.ai import get_chroma_client, get_vectorstore, mark_documents_ingested, COLLECTION_NAME
+from app.utils import preprocess
+
+INDEX_QUEUE_BACKEND = os.getenv("INDEX_QUEUE_BACKEND", "local")  # "local" or "redis"
+INDEX_QUEUE_REDIS_URL = os.getenv("INDEX_QUEUE_REDIS_URL", "redis://localhost:6379/0")
+INDEX_QUEUE_NAME = os.getenv("INDEX_QUEUE_NAME", "drive:index")
+# Only the local queue (single process, tests) is consumed inside the API process; with
+# redis every API process would load the embedding models, so the worker runs on its own
+INDEX_WORKER_IN_APP = INDEX_QUEUE_BACKEND == "local"
+# Files taken off the queue per round; Chroma caches are invalidated once per round
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", 32))
+INDEX_PARSE_WORKERS = int(os.getenv("INDEX_PARSE_WORKERS", 1))
+# Larger files are not indexed
+INDEX_MAX_SOURCE_BYTES = int(os.getenv("INDEX_MAX_SOURCE_BYTES", 50 * 1024 * 1024))
+INDEX_MAX_ATTEMPTS = int(os.getenv("INDEX_MAX_ATTEMPTS", 5))
+INDEX_RETRY_SECONDS = int(os.getenv("INDEX_RETRY_SECONDS", 30))
+
+
+class LocalJobQueue:
+    """In-process queue of file ids; an id already waiting is not added twice."""
+
+    def __init__(self):
+        self.pending = OrderedDict()  # file id -> None, oldest first
+        self.ready = asyncio.Event()
+
+    async def publish(self, file_ids):
+        for file_id in file_ids:
+            self.pending.setdefault(str(file_id))
+        if self.pending:
+            self.ready.set()
+
+    async def take(self, limit: int) -> list:
+        while not self.pending:
+            self.ready.clear()
+            await self.ready.wait()
+        taken = []
+        while self.pending and len(taken) < limit:
+            taken.append(self.pending.popitem(last=False)[0])
+        return taken
+
+    async def size(self) -> int:
+        return len(self.pending)
+
+
+class RedisJobQueue:
+    """
+    Shared queue in a Redis sorted set scored by publish time. ZADD NX keeps
+    an id waiting at most once. Needs the redis package (only imported when
+    this backend is configured).
+    """
+
+    def __init__(self, url: str, name: str):
+        import redis.asyncio as redis
+        self.client = redis.Redis.from_url(url)
+        self.key = name
+
+    async def publish(self, file_ids):
+        members = {str(file_id): time.time() for file_id in file_ids}
+        if members:
+            await self.client.zadd(self.key, members, nx=True)
+
+    async def take(self, limit: int) -> list:
+        while True:
+            first = await self.client.bzpopmin(self.key, timeout=5)
+            if first:
+                break
+        rest = await self.client.zpopmin(self.key, limit - 1) if limit > 1 else []
+        return [member.decode() for member in [first[1]] + [member for member, _ in rest]]
+
+    async def size(self) -> int:
+        return await self.client.zcard(self.key)
+
+
+def make_queue():
+    if INDEX_QUEUE_BACKEND == "redis":
+        return RedisJobQueue(INDEX_QUEUE_REDIS_URL, INDEX_QUEUE_NAME)
+    return LocalJobQueue()
+
+index_queue = make_queue()
+metrics = {"published": 0, "removed": 0, "updated": 0, "copied": 0, "embedded": 0, "unchanged": 0, "skipped": 0, "failed": 0}
+
+
+async def publish(file_ids, event: str):
+    """Queue files for (re)indexing after event. Call it after the change is committed."""
+    file_ids = list(file_ids)
+    if not file_ids:
+        return
+    try:
+        await index_queue.publish(file_ids)
+        metrics["published"] += len(file_ids)
+    except Exception as e:
+        # Search lags behind until the file changes again; the request still succeeds
+        print(f"Could not queue {len(file_ids)} file(s) for indexing after {event}: {e}")
+
+
+# --- Indexing one file ---
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+_captioner = None
+_captioner_lock = threading.Lock()
+text_splitter = preprocess.make_text_splitter()
+
+def parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=INDEX_PARSE_WORKERS)
+        return _parse_pool
+
+def captioner():
+    global _captioner
+    with _captioner_lock:
+        if _captioner is None:
+            _captioner = preprocess.load_captioner()
+        return _captioner
+
+def shutdown():
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def load_file(file_id) -> dict | None:
+    """Snapshot of what indexing needs from the File row (and its Blob's sha256)."""
+    db = SessionLocal()
+    try:
+        row = db.query(models.File, models.Blob.sha256).outerjoin(
+            models.Blob, models.File.blob_id == models.Blob.id
+        ).filter(models.File.id == file_id).first()
+        if row is None:
+            return None
+        file, sha256 = row
+        return {
+            "id": str(file.id),
+            "owner_id": str(file.owner_id),
+            "name": file.original_name,
+            "drive_path": file.drive_path or "/",
+            "physical_path": file.physical_path,
+            "s3_path": file.s3_path,
+            "size": file.size,
+            "sha256": sha256,
+            "live": file.deleted_at is None and file.status == "ready",
+        }
+    finally:
+        db.close()
+
+def read_file(file: dict) -> bytes | None:
+    if file["size"] and file["size"] > INDEX_MAX_SOURCE_BYTES:
+        return None
+    if file["physical_path"] and os.path.exists(file["physical_path"]):
+        with open(file["physical_path"], "rb") as f:
+            return f.read()
+    body = get_object(file["s3_path"])["Body"]
+    try:
+        return body.read()
+    finally:
+        body.close()
+
+def content_id(file: dict) -> str:
+    return file["sha256"] or f"s3:{file['s3_path']}:{file['size']}"
+
+def chunk_content_id(metadata: dict) -> str | None:
+    # Chunks indexed before content ids only carry the sha256
+    return metadata.get("content") or metadata.get("sha256") or None
+
+def file_metadata(file: dict) -> dict:
+    """Metadata every chunk of file carries; Chroma only takes str/int/float/bool values."""
+    return {
+        "source": f"{file['drive_path']}{file['name']}",
+        "file_id": file["id"],
+        "owner_id": file["owner_id"],
+        "content": content_id(file),
+    }
+
+def file_chunk_id(file_id: str, index: int) -> str:
+    return f"file:{file_id}:{index}"
+
+def parse_file(file: dict, data: bytes) -> list:
+    ext = os.path.splitext(file["name"])[1].lower()
+    if ext in preprocess.IMAGE_EXTENSIONS:
+        content = preprocess.analyze_images([data], captioner(), ocr_pool=parse_pool())[0]
+        return [Document(page_content=content)]
+    documents, _ = parse_pool().submit(preprocess.parse_document, file["name"], data).result()
+    return documents
+
+def copy_chunks(collection, content: str, file_id: str):
+    """Chunks (documents, metadatas, embeddings) of another file with this content, in order, or None."""
+    found = collection.get(where={"content": content}, include=["documents", "metadatas", "embeddings"])
+    rows = [row for row in zip(found["documents"], found["metadatas"], found["embeddings"]) if row[1].get("file_id") != file_id]
+    if not rows:
+        return None
+    twin = rows[0][1]["file_id"]
+    return sorted((row for row in rows if row[1]["file_id"] == twin), key=lambda row: row[1].get("chunk", 0))
+
+def index_file(file_id: str) -> str:
+    """Bring file_id's chunks in line with its row. Returns what was done (a metrics key)."""
+    get_vectorstore()  # creates the collection on first use
+    collection = get_chroma_client().get_collection(COLLECTION_NAME)
+    existing = collection.get(where={"file_id": file_id}, include=["metadatas"])
+    file = load_file(file_id)
+
+    if file is None or not file["live"] or not preprocess.is_supported(file["name"]):
+        if not existing["ids"]:
+            return "skipped"
+        collection.delete(ids=existing["ids"])
+        return "removed"
+
+    metadata = file_metadata(file)
+    if existing["ids"] and all(chunk_content_id(m) == metadata["content"] for m in existing["metadatas"]):
+        # Same content: a rename or move only changes metadata
+        if all(m.get(key) == value for m in existing["metadatas"] for key, value in metadata.items()):
+            return "unchanged"
+        collection.update(ids=existing["ids"], metadatas=[{**m, **metadata} for m in existing["metadatas"]])
+        return "updated"
+
+    copied = copy_chunks(collection, metadata["content"], file_id)
+    if copied:
+        ids = [file_chunk_id(file_id, index) for index in range(len(copied))]
+        collection.upsert(
+            ids=ids,
+            documents=[document for document, _, _ in copied],
+            metadatas=[{**m, **metadata, "chunk": index} for index, (_, m, _) in enumerate(copied)],
+            embeddings=[list(embedding) for _, _, embedding in copied],
+        )
+        outcome = "copied"
+    else:
+        data = read_file(file)
+        if data is None:
+            return "skipped"
+        try:
+            documents = parse_file(file, data)
+        except Exception as e:
+            # Not worth retrying; the file is indexed again when it changes
+            print(f"Could not parse {metadata['source']} ({file_id}) for indexing: {e}")
+            documents = []
+        chunks = text_splitter.split_documents(documents)
+        for index, chunk in enumerate(chunks):
+            chunk.metadata.update(metadata, chunk=index)
+        ids = [file_chunk_id(file_id, index) for index in range(len(chunks))]
+        vectorstore = get_vectorstore()
+        for start in range(0, len(chunks), preprocess.BATCH_SIZE):
+            vectorstore.add_documents(chunks[start:start + preprocess.BATCH_SIZE], ids=ids[start:start + preprocess.BATCH_SIZE])
+        outcome = "embedded"
+
+    # The previous version may have had more chunks
+    leftover = sorted(set(existing["ids"]) - set(ids))
+    if leftover:
+        collection.delete(ids=leftover)
+    return outcome
+
+
+# --- Worker ---
+async def run_indexer():
+    """Consume the queue forever. Failed files are re-queued up to INDEX_MAX_ATTEMPTS times."""
+    attempts = {}
+    while True:
+        try:
+            file_ids = await index_queue.take(INDEX_BATCH_SIZE)
+        except Exception as e:
+            print(f"Index queue unavailable: {e}")
+            await asyncio.sleep(INDEX_RETRY_SECONDS)
+            continue
+
+        changed, retry = False, []
+        for file_id in file_ids:
+            try:
+                outcome = await run_in_threadpool(index_file, file_id)
+                attempts.pop(file_id, None)
+            except Exception as e:
+                metrics["failed"] += 1
+                attempts[file_id] = attempts.get(file_id, 0) + 1
+                print(f"Indexing {file_id} failed (attempt {attempts[file_id]}): {e}")
+                if attempts[file_id] < INDEX_MAX_ATTEMPTS:
+                    retry.append(file_id)
+                else:
+                    attempts.pop(file_id)
+                continue
+            metrics[outcome] += 1
+            changed = changed or outcome not in ("unchanged", "skipped")
+
+        if changed:
+            try:
+                # Cached answers may cite removed or outdated chunks
+                await run_in_threadpool(mark_documents_ingested, get_chroma_client())
+            except Exception as e:
+                print(f"Could not mark documents ingested: {e}")
+        if retry:
+            asyncio.get_running_loop().call_later(
+                INDEX_RETRY_SECONDS, lambda ids=retry: asyncio.ensure_future(index_queue.publish(ids))
+            )
+
+async def index_metrics() -> dict:
+    try:
+        queued = await index_queue.size()
+    except Exception:
+        queued = None
+    return {"backend": INDEX_QUEUE_BACKEND, "queued": queued, **metrics}
+
+
+if __name__ == "__main__":
+    # Standalone worker for the redis backend
+    try:
+        asyncio.run(run_indexer())
+    finally:
+        shutdown()
@@ -0,0 +1,63 @@
+import os
+from app import models
+from app.database import SessionLocal
+from app.utils.s3 import delete_many_from_s3
+
+
+def create_job(db, kind: str, owner_id, total: int) -> models.Job:
+    """Add a pending Job row; it is saved with the caller's commit."""
+    job = models.Job(kind=kind, owner_id=owner_id, total=total, status="pending")
+    db.add(job)
+    db.flush()
+    return job
+
+def job_status(job: models.Job) -> dict:
+    return {
+        "job_id": str(job.id),
+        "kind": job.kind,
+        "status": job.status,
+        "total": job.total,
+        "done": job.done,
+        "failed": job.failed,
+        "error": job.error,
+    }
+
+
+def run_delete_job(job_id, stored_objects: list):
+    """
+    Background task: remove the local copies and S3 objects of deleted files.
+    stored_objects is a list of (physical_path, s3_path). S3 keys go out in
+    DeleteObjects batches; progress is written to the Job row per batch.
+    """
+    db = SessionLocal()
+    try:
+        job = db.query(models.Job).filter(models.Job.id == job_id).first()
+        job.status = "running"
+        db.commit()
+
+        for physical_path, _ in stored_objects:
+            try:
+                if physical_path and os.path.exists(physical_path):
+                    os.remove(physical_path)
+            except OSError as e:
+                print(f"Local delete failed for {physical_path}: {e}")
+
+        def on_batch(deleted, failed):
+            job.done += deleted
+            job.failed += failed
+            db.commit()
+
+        s3_keys = [s3_path for _, s3_path in stored_objects if s3_path]
+        job.done += len(stored_objects) - len(s3_keys)  # nothing to do in S3 for these
+        failed_keys = delete_many_from_s3(s3_keys, on_batch=on_batch)
+
+        job.failed_items = failed_keys or None
+        job.status = "failed" if failed_keys else "done"
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        db.query(models.Job).filter(models.Job.id == job_id).update({"status": "failed", "error": str(e)})
+        db.commit()
+        print(f"Delete job {job_id} failed: {e}")
+    finally:
+        db.close()
@@ -1,8 +1,16 @@
 import os
 import io
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import pandas as pd
 import boto3
-from PIL import Image
+from PIL import Image, ImageOps
 import pytesseract
 import chromadb
 
@@ -17,6 +25,7 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_core.documents import Document
+from app.utils.ai import mark_documents_ingested, SHARED_CORPUS
 
 # ------------------------
 # S3 CONFIG
@@ -27,6 +36,37 @@ AWS_REGION = os.getenv("AWS_REGION", "ap-south-1")
 
 s3_client = boto3.client("s3", region_name=AWS_REGION)
 
+# ------------------------
+# PIPELINE CONFIG
+# ------------------------
+# Downloads are I/O bound (threads); parsing is CPU bound (processes)
+DOWNLOAD_WORKERS = int(os.getenv("PREPROCESS_DOWNLOAD_WORKERS", 8))
+PARSE_WORKERS = int(os.getenv("PREPROCESS_PARSE_WORKERS", os.cpu_count() or 2))
+# Objects downloaded or being parsed at once; bounds memory use
+MAX_IN_FLIGHT = int(os.getenv("PREPROCESS_MAX_IN_FLIGHT", 2 * (DOWNLOAD_WORKERS + PARSE_WORKERS)))
+# Chunks embedded and upserted per Chroma call
+BATCH_SIZE = int(os.getenv("PREPROCESS_BATCH_SIZE", 256))
+# Where progress is kept between runs
+STATE_DIR = os.getenv("PREPROCESS_STATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".preprocess"))
+CHECKPOINT_PATH = os.path.join(STATE_DIR, "checkpoint.json")
+MANIFEST_PATH = os.path.join(STATE_DIR, "manifest.sqlite3")
+STATS_INTERVAL = int(os.getenv("PREPROCESS_STATS_INTERVAL_SECONDS", 30))
+
+CAPTION_MODEL = "Salesforce/blip-image-captioning-large"
+# Images captioned per model call; OCR runs in its own processes meanwhile
+CAPTION_BATCH_SIZE = int(os.getenv("PREPROCESS_CAPTION_BATCH_SIZE", 8))
+OCR_WORKERS = int(os.getenv("PREPROCESS_OCR_WORKERS", os.cpu_count() or 2))
+# Images are downsized to these longest edges first: BLIP sees 384px anyway,
+# OCR needs more detail but not a full camera frame
+CAPTION_MAX_EDGE = int(os.getenv("PREPROCESS_CAPTION_MAX_EDGE", 768))
+OCR_MAX_EDGE = int(os.getenv("PREPROCESS_OCR_MAX_EDGE", 2000))
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png"]
+# Loaders that need a real file on disk
+FILE_LOADERS = {".pdf": PyPDFLoader, ".docx": Docx2txtLoader, ".pptx": UnstructuredPowerPointLoader}
+
 
 def parse_spreadsheet_from_bytes(file_bytes: bytes, ext: str) -> str:
     """Parse CSV/XLSX from raw bytes."""
@@ -47,67 +87,263 @@ def parse_spreadsheet_from_bytes(file_bytes: bytes, ext: str) -> str:
         return ""
 
 
+def load_image(file_bytes: bytes, max_edge: int, mode: str = "RGB") -> Image.Image:
+    """Decode image bytes in memory, upright and no larger than max_edge."""
+    image = Image.open(io.BytesIO(file_bytes))
+    # JPEGs are decoded at a reduced scale straight away
+    image.draft(mode, (max_edge, max_edge))
+    image = ImageOps.exif_transpose(image).convert(mode)
+    image.thumbnail((max_edge, max_edge))
+    return image
+
+
+def ocr_image_bytes(file_bytes: bytes) -> str:
+    """Runs in the OCR processes (or inline without a pool)."""
+    return pytesseract.image_to_string(load_image(file_bytes, OCR_MAX_EDGE, "L"))
+
+
+def caption_images(images: list, captioner) -> list:
+    """Caption decoded images in batches of CAPTION_BATCH_SIZE; a failing batch falls back to one by one."""
+    captions = []
+    for start in range(0, len(images), CAPTION_BATCH_SIZE):
+        batch = images[start:start + CAPTION_BATCH_SIZE]
+        try:
+            results = captioner(batch, batch_size=len(batch))
+            captions.extend(result[0]["generated_text"] for result in results)
+        except Exception:
+            for image in batch:
+                try:
+                    captions.append(captioner(image)[0]["generated_text"])
+                except Exception as e:
+                    captions.append(f"Caption generation failed: {e}")
+    return captions
+
+
+def analyze_images(images: list, captioner, ocr_pool=None) -> list:
+    """
+    Caption and OCR a list of image bytes, one text per image. OCR is
+    started in ocr_pool first, so it runs while this process captions.
+    """
+    ocr_futures = [ocr_pool.submit(ocr_image_bytes, file_bytes) for file_bytes in images] if ocr_pool else None
+
+    decoded, failed = [], {}
+    for index, file_bytes in enumerate(images):
+        try:
+            decoded.append(load_image(file_bytes, CAPTION_MAX_EDGE))
+        except Exception as e:
+            failed[index] = f"Caption generation failed: {e}"
+    captions = iter(caption_images(decoded, captioner))
+
+    contents = []
+    for index, file_bytes in enumerate(images):
+        caption = failed.get(index) or next(captions)
+        try:
+            ocr_text = ocr_futures[index].result() if ocr_futures else ocr_image_bytes(file_bytes)
+        except Exception as e:
+            ocr_text = f"OCR failed: {e}"
+        contents.append(f"Image Caption: {caption}\n\nExtracted Text (OCR):\n{ocr_text}")
+    return contents
+
+
 def process_image_with_pipeline_bytes(file_bytes: bytes, ext: str, captioner) -> str:
-    """Run captioning + OCR on image bytes."""
-    try:
-        # Save temporarily to pass to captioner (pipeline expects path or PIL)
-        img = Image.open(io.BytesIO(file_bytes))
-        img_path = f"/tmp/temp_image{ext}"
-        img.save(img_path)
+    """Run captioning + OCR on one image's bytes."""
+    return analyze_images([file_bytes], captioner)[0]
 
-        caption_result = captioner(img_path)
-        caption = caption_result[0]["generated_text"]
-    except Exception as e:
-        caption = f"Caption generation failed: {e}"
 
-    try:
-        ocr_text = pytesseract.image_to_string(img)
-    except Exception as e:
-        ocr_text = f"OCR failed: {e}"
+# ------------------------
+# PIPELINE STAGES
+# ------------------------
+def list_objects(prefix: str, start_after: str | None = None):
+    """Yield every object under prefix, page by page, in key order."""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    params = {"Bucket": S3_BUCKET, "Prefix": prefix}
+    if start_after:
+        params["StartAfter"] = start_after
+    for page in paginator.paginate(**params):
+        yield from page.get("Contents", [])
+
 
-    return f"Image Caption: {caption}\n\nExtracted Text (OCR):\n{ocr_text}"
+def download_object(key: str) -> tuple[bytes, float]:
+    """Runs in the download threads. Returns the content and seconds spent."""
+    start = time.perf_counter()
+    obj = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
+    return obj["Body"].read(), time.perf_counter() - start
 
 
-def load_document_from_s3(key: str, captioner):
-    """Download file from S3 and parse it into LangChain Documents."""
+def parse_document(key: str, file_bytes: bytes) -> tuple[list, float]:
+    """
+    Runs in the parser processes: turn a non-image object into Documents.
+    Returns them with the seconds spent.
+    """
+    start = time.perf_counter()
     ext = os.path.splitext(key)[1].lower()
-    obj = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
-    file_bytes = obj["Body"].read()
-
-    if ext == ".pdf":
-        tmp = f"/tmp/{os.path.basename(key)}"
-        with open(tmp, "wb") as f:
-            f.write(file_bytes)
-        return PyPDFLoader(tmp).load()
-
-    elif ext == ".docx":
-        tmp = f"/tmp/{os.path.basename(key)}"
-        with open(tmp, "wb") as f:
-            f.write(file_bytes)
-        return Docx2txtLoader(tmp).load()
-
-    elif ext == ".pptx":
-        tmp = f"/tmp/{os.path.basename(key)}"
-        with open(tmp, "wb") as f:
-            f.write(file_bytes)
-        return UnstructuredPowerPointLoader(tmp).load()
+    documents = []
+
+    if ext in FILE_LOADERS:
+        # Own temp dir per call, so parallel parsers never share a path
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp = os.path.join(tmp_dir, f"document{ext}")
+            with open(tmp, "wb") as f:
+                f.write(file_bytes)
+            documents = FILE_LOADERS[ext](tmp).load()
 
     elif ext == ".txt":
-        return [Document(page_content=file_bytes.decode("utf-8"), metadata={"source": key})]
+        documents = [Document(page_content=file_bytes.decode("utf-8"))]
 
     elif ext in [".csv", ".xlsx"]:
         content = parse_spreadsheet_from_bytes(file_bytes, ext)
         if content:
-            return [Document(page_content=content, metadata={"source": key})]
+            documents = [Document(page_content=content)]
 
-    elif ext in [".jpg", ".jpeg", ".png"]:
-        content = process_image_with_pipeline_bytes(file_bytes, ext, captioner)
-        if content:
-            return [Document(page_content=content, metadata={"source": key})]
+    for document in documents:
+        document.metadata["source"] = key
+    return documents, time.perf_counter() - start
+
+
+def load_captioner():
+    return pipeline("image-to-text", model=CAPTION_MODEL)
+
+
+def make_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+def is_supported(key: str) -> bool:
+    ext = os.path.splitext(key)[1].lower()
+    return ext in FILE_LOADERS or ext in IMAGE_EXTENSIONS or ext in [".txt", ".csv", ".xlsx"]
+
+
+LEGACY_CLEANED_FLAG = "legacy_chunks_cleaned"
+
+def legacy_sources(key: str) -> list:
+    """
+    The "source" values the pre-manifest code gave key's chunks: the key,
+    or for PDF/DOCX/PPTX the /tmp path the loader read from.
+    """
+    return [key, f"/tmp/{os.path.basename(key)}"]
+
+
+def chunk_id(key: str, index: int) -> str:
+    """Stable chunk ids, so re-running a batch overwrites instead of duplicating."""
+    return f"{hashlib.sha1(key.encode()).hexdigest()}:{index}"
 
-    else:
-        print(f"Skipping unsupported file type: {ext}")
-        return []
+
+class StageStats:
+    """Items, bytes and busy seconds per pipeline stage."""
+
+    def __init__(self, *stages: str):
+        self.started = time.perf_counter()
+        self.stages = {stage: {"items": 0, "bytes": 0, "seconds": 0.0} for stage in stages}
+
+    def record(self, stage: str, items: int = 1, seconds: float = 0.0, nbytes: int = 0):
+        entry = self.stages[stage]
+        entry["items"] += items
+        entry["bytes"] += nbytes
+        entry["seconds"] += seconds
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        lines = [f"after {elapsed:.0f}s:"]
+        for stage, entry in self.stages.items():
+            line = f"  {stage:>8}: {entry['items']} items, {entry['items'] / max(elapsed, 1e-9):.1f}/s wall"
+            if entry["seconds"]:
+                line += f", {entry['items'] / entry['seconds']:.1f}/s per worker"
+            if entry["bytes"]:
+                line += f", {entry['bytes'] / 1e6 / max(elapsed, 1e-9):.1f} MB/s"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+class Checkpoint:
+    """
+    Keys are listed in order but finish out of order. The checkpoint is the
+    last key such that it and every key before it are fully upserted; a new
+    run lists from there with StartAfter. run_id identifies the listing pass
+    a resumed run continues.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.order = deque()
+        self.finished = set()
+        self.watermark = None
+        self.run_id = None
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.watermark = state.get("last_key")
+            self.run_id = state.get("run_id")
+        self.run_id = self.run_id or uuid.uuid4().hex
+
+    def started(self, key: str):
+        self.order.append(key)
+
+    def finish(self, key: str):
+        self.finished.add(key)
+        while self.order and self.order[0] in self.finished:
+            self.finished.discard(self.order[0])
+            self.watermark = self.order.popleft()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"last_key": self.watermark, "run_id": self.run_id}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Manifest:
+    """
+    Local SQLite record of what is indexed: key -> ETag, size, mtime and the
+    Chroma ids of its chunks, plus the listing pass (run) that last saw it.
+    Objects whose ETag and size match are skipped; objects no pass saw any
+    more have their chunks removed.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            "key TEXT PRIMARY KEY, etag TEXT, size INTEGER, mtime TEXT, chunk_ids TEXT NOT NULL, seen_run TEXT)"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+
+    def flag(self, name: str) -> bool:
+        return self.db.execute("SELECT 1 FROM meta WHERE name = ?", (name,)).fetchone() is not None
+
+    def set_flag(self, name: str):
+        self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, '1')", (name,))
+
+    def get(self, key: str):
+        row = self.db.execute("SELECT etag, size, chunk_ids FROM objects WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "size": row[1], "chunk_ids": json.loads(row[2])}
+
+    def touch(self, key: str, run_id: str):
+        self.db.execute("UPDATE objects SET seen_run = ? WHERE key = ?", (run_id, key))
+
+    def record(self, obj: dict, chunk_ids: list, run_id: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO objects (key, etag, size, mtime, chunk_ids, seen_run) VALUES (?, ?, ?, ?, ?, ?)",
+            (obj["Key"], obj["ETag"], obj["Size"], str(obj.get("LastModified")), json.dumps(chunk_ids), run_id),
+        )
+
+    def stale(self, run_id: str) -> list:
+        """(key, chunk ids) of objects the given pass never listed."""
+        rows = self.db.execute("SELECT key, chunk_ids FROM objects WHERE seen_run IS NOT ?", (run_id,))
+        return [(key, json.loads(chunk_ids)) for key, chunk_ids in rows]
+
+    def remove(self, keys: list):
+        self.db.executemany("DELETE FROM objects WHERE key = ?", [(key,) for key in keys])
+
+    def commit(self):
+        self.db.commit()
 
 
 def main():
@@ -115,35 +351,194 @@ def main():
     CHROMA_PORT = int(os.getenv("CHROMA_PORT", 8000))
     COLLECTION_NAME = "multimodal_documents_collection"
 
-    captioner = pipeline("image-to-text", model="Salesforce/blip-image-captioning-large")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    captioner = load_captioner()
+    text_splitter = make_text_splitter()
     embedding_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
 
     chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
     vector_db = Chroma(client=chroma_client, collection_name=COLLECTION_NAME, embedding_function=embedding_model)
 
-    existing_items = vector_db.get(include=["metadatas"])
-    existing_sources = set(item["source"] for item in existing_items["metadatas"])
+    checkpoint = Checkpoint(CHECKPOINT_PATH)
+    if checkpoint.watermark:
+        print(f"Resuming after {checkpoint.watermark}")
 
-    response = s3_client.list_objects_v2(Bucket=S3_BUCKET, Prefix=S3_PREFIX)
-    if "Contents" not in response:
-        print("No files found in S3 bucket.")
-        return
+    manifest = Manifest(MANIFEST_PATH)
+    # Chunks indexed before the manifest existed have random ids; until one
+    # full pass has gone through without failures (resumes included), they
+    # are deleted by source before a key is added
+    legacy_collection = None if manifest.flag(LEGACY_CLEANED_FLAG) else chroma_client.get_collection(COLLECTION_NAME)
 
-    files_to_process = [obj["Key"] for obj in response["Contents"] if obj["Key"] not in existing_sources]
-    if not files_to_process:
-        print("No new files to process. ✅")
-        return
+    stats = StageStats("list", "download", "parse", "images", "embed")
+    listed = {}           # key -> listing entry, while the key is being processed
+    pending = []          # (key, chunk index, Document) waiting for the next batch
+    unflushed = {}        # key -> chunks of it not yet upserted
+    obsolete_ids = []     # chunk ids of earlier versions, deleted after each batch
+    counts = {"chunks": 0, "changed": 0, "unchanged": 0, "removed": 0, "failed": 0}
+    last_report = time.perf_counter()
+
+    def complete(key: str, chunk_count: int):
+        """All chunks of key are stored: update the manifest and drop what the old version had beyond them."""
+        chunk_ids = [chunk_id(key, index) for index in range(chunk_count)]
+        previous = manifest.get(key)
+        if previous:
+            obsolete_ids.extend(set(previous["chunk_ids"]) - set(chunk_ids))
+        manifest.record(listed.pop(key), chunk_ids, checkpoint.run_id)
+        checkpoint.finish(key)
+
+    def save_progress():
+        if obsolete_ids:
+            for start in range(0, len(obsolete_ids), BATCH_SIZE):
+                vector_db.delete(ids=obsolete_ids[start:start + BATCH_SIZE])
+            obsolete_ids.clear()
+        # Manifest first: the checkpoint must never be ahead of it
+        manifest.commit()
+        checkpoint.save()
+
+    def flush():
+        if not pending:
+            return
+        start = time.perf_counter()
+        vector_db.add_documents(
+            [chunk for _, _, chunk in pending],
+            ids=[chunk_id(key, index) for key, index, _ in pending],
+        )
+        stats.record("embed", items=len(pending), seconds=time.perf_counter() - start)
+        counts["chunks"] += len(pending)
+
+        for key, index, _ in pending:
+            unflushed[key] -= 1
+            if unflushed[key] == 0:
+                del unflushed[key]
+                complete(key, index + 1)
+        pending.clear()
+        save_progress()
+
+    def add_documents(key: str, documents: list):
+        chunks = text_splitter.split_documents(documents) if documents else []
+        for chunk in chunks:
+            chunk.metadata["corpus"] = SHARED_CORPUS
+        if legacy_collection is not None:
+            legacy_collection.delete(where={"$or": [{"source": source} for source in legacy_sources(key)]})
+        if not chunks:
+            complete(key, 0)
+            return
+        unflushed[key] = len(chunks)
+        for index, chunk in enumerate(chunks):
+            pending.append((key, index, chunk))
+            if len(pending) >= BATCH_SIZE:
+                flush()
+
+    listing = list_objects(S3_PREFIX, start_after=checkpoint.watermark)
+    in_flight = {}  # future -> (key, stage)
+    images = []     # (key, bytes) waiting for the next captioning batch
+    listing_done = False
 
-    all_chunks = []
-    for key in files_to_process:
-        documents = load_document_from_s3(key, captioner)
-        if not documents: continue
-        all_chunks.extend(text_splitter.split_documents(documents))
+    def analyze_batch(ocr_pool):
+        # The captioning model lives in this process; OCR runs in ocr_pool meanwhile
+        start = time.perf_counter()
+        contents = analyze_images([file_bytes for _, file_bytes in images], captioner, ocr_pool)
+        stats.record("images", items=len(images), seconds=time.perf_counter() - start)
+        batch = [key for key, _ in images]
+        images.clear()
+        for key, content in zip(batch, contents):
+            add_documents(key, [Document(page_content=content, metadata={"source": key})])
 
-    if all_chunks:
-        vector_db.add_documents(all_chunks)
-        print(f"✅ {len(all_chunks)} chunks added to ChromaDB")
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as downloads, \
+            ProcessPoolExecutor(max_workers=PARSE_WORKERS) as parsers, \
+            ProcessPoolExecutor(max_workers=OCR_WORKERS) as ocr_pool:
+        while True:
+            # ---- Keep the pools fed from the listing, up to MAX_IN_FLIGHT ----
+            while not listing_done and len(in_flight) + len(images) < MAX_IN_FLIGHT:
+                obj = next(listing, None)
+                if obj is None:
+                    listing_done = True
+                    break
+                key = obj["Key"]
+                stats.record("list")
+                checkpoint.started(key)
+
+                # ---- Diff against the manifest ----
+                indexed = manifest.get(key)
+                if indexed:
+                    manifest.touch(key, checkpoint.run_id)
+                if indexed and indexed["etag"] == obj["ETag"] and indexed["size"] == obj["Size"]:
+                    counts["unchanged"] += 1
+                    checkpoint.finish(key)
+                    continue
+                counts["changed"] += 1
+                listed[key] = obj
+                if not is_supported(key):
+                    complete(key, 0)
+                    continue
+                in_flight[downloads.submit(download_object, key)] = (key, "download")
+
+            if not in_flight:
+                # Nothing else to wait for: caption a partial batch
+                if images:
+                    analyze_batch(ocr_pool)
+                    continue
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, stage = in_flight.pop(future)
+                documents = None
+                try:
+                    if stage == "download":
+                        file_bytes, seconds = future.result()
+                        stats.record("download", seconds=seconds, nbytes=len(file_bytes))
+                        ext = os.path.splitext(key)[1].lower()
+                        if ext in IMAGE_EXTENSIONS:
+                            images.append((key, file_bytes))
+                        else:
+                            in_flight[parsers.submit(parse_document, key, file_bytes)] = (key, "parse")
+                    else:
+                        documents, seconds = future.result()
+                        stats.record("parse", seconds=seconds)
+                except Exception as e:
+                    # A bad object is skipped (and retried next run, as the
+                    # manifest still has its old ETag); a failing upsert below stops the run
+                    print(f"Failed to process {key}: {e}")
+                    counts["failed"] += 1
+                    listed.pop(key, None)
+                    checkpoint.finish(key)
+                    continue
+                if documents is not None:
+                    add_documents(key, documents)
+            if len(images) >= CAPTION_BATCH_SIZE:
+                analyze_batch(ocr_pool)
+
+            if time.perf_counter() - last_report >= STATS_INTERVAL:
+                save_progress()
+                print(stats.report())
+                last_report = time.perf_counter()
+
+    flush()
+    save_progress()
+    print(stats.report())
+
+    # ---- Objects gone from the bucket: drop their chunks ----
+    stale = manifest.stale(checkpoint.run_id)
+    stale_ids = [chunk for _, chunk_ids in stale for chunk in chunk_ids]
+    for start in range(0, len(stale_ids), BATCH_SIZE):
+        vector_db.delete(ids=stale_ids[start:start + BATCH_SIZE])
+    manifest.remove([key for key, _ in stale])
+    if legacy_collection is not None and not counts["failed"]:
+        manifest.set_flag(LEGACY_CLEANED_FLAG)
+    manifest.commit()
+    counts["removed"] = len(stale)
+
+    if counts["changed"] or counts["removed"]:
+        # Answers cached by the API may be stale now
+        mark_documents_ingested(chroma_client, COLLECTION_NAME)
+        print(
+            f"✅ {counts['changed']} new or changed files ({counts['chunks']} chunks), "
+            f"{counts['removed']} removed, {counts['unchanged']} unchanged"
+        )
+    else:
+        print("No new files to process. ✅")
+    # Finished the whole listing; the next run starts from the top again
+    checkpoint.clear()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
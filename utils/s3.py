@@ -1,25 +1,121 @@
-import boto3, os
+import boto3, os, base64
+from urllib.parse import quote
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Set to point at an S3-compatible stand-in (moto server, MinIO) in tests / local dev
+S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL")
+
 s3_client = boto3.client(
     "s3",
     aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
     aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
     region_name=os.getenv("AWS_REGION"),
+    endpoint_url=S3_ENDPOINT_URL,
+    config=Config(signature_version="s3v4"),
 )
 
 BUCKET_NAME = os.getenv("AWS_S3_BUCKET")
 BUCKET_REGION = os.getenv("AWS_REGION")
 
+# Lifetime of presigned upload / download URLs
+PRESIGNED_URL_EXPIRY = int(os.getenv("PRESIGNED_URL_EXPIRY_SECONDS", 900))
+
+# S3 rejects multipart parts smaller than 5 MiB (except the last one)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_PART_SIZE = max(int(os.getenv("S3_PART_SIZE", 8 * 1024 * 1024)), S3_MIN_PART_SIZE)
+
+# DeleteObjects accepts at most 1000 keys per call
+S3_DELETE_BATCH_SIZE = 1000
+S3_DELETE_CONCURRENCY = int(os.getenv("S3_DELETE_CONCURRENCY", 8))
+
+def get_s3_url(s3_key: str) -> str:
+    """Public URL of an object in the bucket"""
+    if S3_ENDPOINT_URL:
+        return f"{S3_ENDPOINT_URL.rstrip('/')}/{BUCKET_NAME}/{s3_key}"
+    return f"https://{BUCKET_NAME}.s3.{BUCKET_REGION}.amazonaws.com/{s3_key}"
+
 def upload_to_s3(local_path: str, content_type:str , s3_key: str):
     """Uploads file to S3 with given key"""
     s3_client.upload_file(local_path, BUCKET_NAME, s3_key,   ExtraArgs={
         "ContentType": content_type,
         "ContentDisposition": "inline",
     })
-    return f"https://{BUCKET_NAME}.s3.{BUCKET_REGION}.amazonaws.com/{s3_key}"
+    return get_s3_url(s3_key)
+
+def put_bytes_to_s3(data: bytes, content_type: str, s3_key: str):
+    """Uploads an in-memory object to S3 with a single PUT"""
+    s3_client.put_object(
+        Bucket=BUCKET_NAME,
+        Key=s3_key,
+        Body=data,
+        ContentType=content_type,
+        ContentDisposition="inline",
+    )
+    return get_s3_url(s3_key)
+
+
+class MultipartUpload:
+    """
+    Thin wrapper around an S3 multipart upload.
+    Parts are numbered in the order upload_part is called unless a
+    part_number is given. Pass upload_id to resume an upload that was
+    started earlier (e.g. by a resumable upload session).
+    """
+
+    def __init__(self, s3_key: str, content_type: str, upload_id: str | None = None):
+        self.s3_key = s3_key
+        self.content_type = content_type
+        self.upload_id = upload_id
+        self.parts = []
+
+    def start(self):
+        response = s3_client.create_multipart_upload(
+            Bucket=BUCKET_NAME,
+            Key=self.s3_key,
+            ContentType=self.content_type,
+            ContentDisposition="inline",
+        )
+        self.upload_id = response["UploadId"]
+        return self.upload_id
+
+    def upload_part(self, data: bytes, part_number: int | None = None):
+        part_number = part_number or len(self.parts) + 1
+        response = s3_client.upload_part(
+            Bucket=BUCKET_NAME,
+            Key=self.s3_key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        self.parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+        return response["ETag"]
+
+    def complete(self, parts: list | None = None):
+        parts = parts if parts is not None else self.parts
+        s3_client.complete_multipart_upload(
+            Bucket=BUCKET_NAME,
+            Key=self.s3_key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": sorted(parts, key=lambda p: p["PartNumber"])},
+        )
+        return get_s3_url(self.s3_key)
+
+    def abort(self) -> bool:
+        """True once the upload is gone (aborted now or already)."""
+        try:
+            s3_client.abort_multipart_upload(Bucket=BUCKET_NAME, Key=self.s3_key, UploadId=self.upload_id)
+            return True
+        except s3_client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchUpload":
+                return True
+            print(f"Error aborting multipart upload {self.s3_key}: {e}")
+        except Exception as e:
+            print(f"Error aborting multipart upload {self.s3_key}: {e}")
+        return False
 
 
 def delete_from_s3(s3_key: str):
@@ -33,15 +129,107 @@ def delete_from_s3(s3_key: str):
         print(f"Error deleting {s3_key} from S3: {e}")
         return False
 
-def rename_in_s3(old_s3_key: str,new_s3_key: str):
+def delete_many_from_s3(s3_keys: list, on_batch=None) -> list:
+    """
+    Deletes keys with DeleteObjects in batches of 1000, running several
+    batches concurrently. on_batch(deleted, failed) is called as each batch
+    finishes. Returns the keys that could not be deleted.
+    """
+    batches = [s3_keys[i:i + S3_DELETE_BATCH_SIZE] for i in range(0, len(s3_keys), S3_DELETE_BATCH_SIZE)]
+
+    def delete_batch(batch):
+        try:
+            response = s3_client.delete_objects(
+                Bucket=BUCKET_NAME,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+            return [error["Key"] for error in response.get("Errors", [])]
+        except Exception as e:
+            print(f"Error deleting batch of {len(batch)} keys from S3: {e}")
+            return list(batch)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=S3_DELETE_CONCURRENCY) as pool:
+        for batch, errors in zip(batches, pool.map(delete_batch, batches)):
+            failed.extend(errors)
+            if on_batch:
+                on_batch(len(batch) - len(errors), len(errors))
+    return failed
+
+
+def presign_put(s3_key: str, content_type: str, sha256: str | None = None, expires_in: int = PRESIGNED_URL_EXPIRY) -> dict:
+    """
+    Presigned PUT for a direct client upload. When sha256 (hex) is given it
+    is signed in as x-amz-checksum-sha256, so S3 rejects any other content.
+    Returns the URL and the headers the client must send with it.
+    """
+    params = {
+        "Bucket": BUCKET_NAME,
+        "Key": s3_key,
+        "ContentType": content_type,
+        "ContentDisposition": "inline",
+    }
+    headers = {"Content-Type": content_type, "Content-Disposition": "inline"}
+    if sha256:
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        params["ChecksumSHA256"] = checksum
+        headers["x-amz-checksum-sha256"] = checksum
+
+    url = s3_client.generate_presigned_url("put_object", Params=params, ExpiresIn=expires_in)
+    return {"url": url, "headers": headers}
+
+def presign_post(s3_key: str, content_type: str, max_size: int, expires_in: int = PRESIGNED_URL_EXPIRY) -> dict:
+    """Presigned POST policy (for browser form uploads) limited to max_size bytes."""
+    return s3_client.generate_presigned_post(
+        BUCKET_NAME,
+        s3_key,
+        Fields={"Content-Type": content_type, "Content-Disposition": "inline"},
+        Conditions=[
+            {"Content-Type": content_type},
+            {"Content-Disposition": "inline"},
+            ["content-length-range", 0, max_size],
+        ],
+        ExpiresIn=expires_in,
+    )
+
+def content_disposition(file_name: str, disposition: str = "inline") -> str:
+    """Content-Disposition with the name RFC 5987-encoded, so quotes, ';' and non-ASCII are safe."""
+    return f"{disposition}; filename*=UTF-8''{quote(file_name)}"
+
+def presign_get(s3_key: str, file_name: str | None = None, expires_in: int = PRESIGNED_URL_EXPIRY) -> str:
+    """Presigned GET, optionally presenting the object under file_name."""
+    params = {"Bucket": BUCKET_NAME, "Key": s3_key}
+    if file_name:
+        params["ResponseContentDisposition"] = content_disposition(file_name)
+    return s3_client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
+
+def get_object(s3_key: str, byte_range: str | None = None) -> dict:
+    """
+    GetObject, optionally for a "bytes=..." range. The returned dict carries a
+    streaming Body plus ContentLength / ContentRange from S3.
+    """
+    params = {"Bucket": BUCKET_NAME, "Key": s3_key}
+    if byte_range:
+        params["Range"] = byte_range
+    return s3_client.get_object(**params)
+
+def download_from_s3(s3_key: str, local_path: str):
+    """Downloads an object to local_path (multipart / concurrent for large objects)."""
+    s3_client.download_file(BUCKET_NAME, s3_key, local_path)
+
+def head_object(s3_key: str) -> dict | None:
+    """Object metadata (size, ETag, SHA-256 checksum if uploaded with one), or None if missing."""
     try:
-        # Copy old object to new key
-        s3_client.copy_object(
-            Bucket=BUCKET_NAME,
-            CopySource={'Bucket': BUCKET_NAME, 'Key': old_s3_key},
-            Key=new_s3_key
-        )
-        # Delete old object
-        s3_client.delete_object(Bucket=BUCKET_NAME, Key=old_s3_key)
-    except Exception as e:
-        print(f"Error renaming file in S3: {str(e)}")
\ No newline at end of file
+        response = s3_client.head_object(Bucket=BUCKET_NAME, Key=s3_key, ChecksumMode="ENABLED")
+    except s3_client.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+    checksum = response.get("ChecksumSHA256")
+    return {
+        "size": response["ContentLength"],
+        "etag": response["ETag"],
+        "content_type": response.get("ContentType"),
+        "sha256": base64.b64decode(checksum).hex() if checksum and "-" not in checksum else None,
+    }
@@ -0,0 +1,80 @@
+import os, hashlib
+from typing import Awaitable, Callable
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from app.utils.s3 import S3_PART_SIZE, MultipartUpload, put_bytes_to_s3
+
+# How much of the request body is pulled into memory per read
+UPLOAD_READ_SIZE = int(os.getenv("UPLOAD_READ_SIZE", 1024 * 1024))
+
+
+async def stream_to_s3(
+    file: UploadFile,
+    s3_key: str,
+    content_type: str,
+    local_path: str | None = None,
+    is_known: Callable[[str], Awaitable] | None = None,
+) -> dict:
+    """
+    Streams an UploadFile to S3 without reading it into memory at once.
+
+    Chunks are buffered until they make up one S3 part and then sent as a
+    multipart upload, so peak memory is about one part per request. Files
+    smaller than a part go up with a single PUT. If local_path is given the
+    same chunks are also written there (in the threadpool, like the S3 calls,
+    so disk I/O doesn't stall the event loop).
+
+    The SHA-256 of the content is computed on the way through. If is_known
+    resolves to something truthy for it, the object is not stored: small files skip the PUT
+    entirely and multipart uploads are aborted instead of completed.
+    """
+    buffer = bytearray()
+    size = 0
+    digest = hashlib.sha256()
+    duplicate = False
+    s3_url = None
+    upload = None
+    local_file = await run_in_threadpool(open, local_path, "wb") if local_path else None
+
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_READ_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            digest.update(chunk)
+            if local_file:
+                await run_in_threadpool(local_file.write, chunk)
+
+            buffer += chunk
+            if len(buffer) >= S3_PART_SIZE:
+                if upload is None:
+                    upload = MultipartUpload(s3_key, content_type)
+                    await run_in_threadpool(upload.start)
+                await run_in_threadpool(upload.upload_part, bytes(buffer))
+                buffer.clear()
+
+        duplicate = bool(is_known and await is_known(digest.hexdigest()))
+        if duplicate:
+            if upload is not None:
+                await run_in_threadpool(upload.abort)
+        elif upload is None:
+            s3_url = await run_in_threadpool(put_bytes_to_s3, bytes(buffer), content_type, s3_key)
+        else:
+            if buffer:
+                await run_in_threadpool(upload.upload_part, bytes(buffer))
+            s3_url = await run_in_threadpool(upload.complete)
+    except BaseException:
+        if upload is not None:
+            await run_in_threadpool(upload.abort)
+        if local_file:
+            await run_in_threadpool(local_file.close)
+            await run_in_threadpool(os.remove, local_path)
+        raise
+
+    if local_file:
+        await run_in_threadpool(local_file.close)
+        if duplicate:
+            await run_in_threadpool(os.remove, local_path)
+
+    return {"s3_url": s3_url, "size": size, "sha256": digest.hexdigest(), "duplicate": duplicate}